@@ -1,11 +1,26 @@
 from ollama import chat
 from ollama import ChatResponse
 import json
-from typing import Dict, List, Any, Optional
+import threading
+import time
+from typing import Dict, List, Any, Iterator, Optional
 from rag_search_execution import *
+from lru_cache import LRUCache
+from answer_cache import SemanticCache
+from context_builder import RESPONSE_INSTRUCTIONS, RESULT_EMBEDDING_FIELD, build_context
+from query_rules import activity_terms, extract_rule_based, location_terms, normalize_query
+from park_shapes import load_park_shapes
+from spatial_index import load_spatial_index
+from local_search import parse_distance_km
+from tracing import NULL_TRACE, metrics_registry
+from concurrency import AdmissionController, Overloaded, Unbounded
+import clip_processor
 
 
 index = os.getenv('ES_INDEX')
+# Retrieval settings of process_parks_query, see search_parks_elasticsearch
+FUSION_MODE = os.getenv('FUSION_MODE', 'server')
+GEO_FILTER_MODE = os.getenv('GEO_FILTER_MODE', 'distance')
 
 national_parks = {
     "mt_rainier_national_park": {
@@ -55,6 +70,44 @@ national_parks = {
 }
 
 
+# Extracted parameters keyed by normalized query
+search_parameters_cache = LRUCache(maxsize=int(os.getenv('SEARCH_PARAMETERS_CACHE_SIZE', 512)))
+answer_cache = SemanticCache(maxsize=int(os.getenv('ANSWER_CACHE_SIZE', 256)),
+                             threshold=float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95)),
+                             ttl_seconds=float(os.getenv('ANSWER_CACHE_TTL', 3600)))
+# Bounds concurrent and queued Ollama calls when LLM_MAX_CONCURRENCY is set
+llm_admission = (AdmissionController(max_concurrent=int(os.getenv('LLM_MAX_CONCURRENCY')),
+                                     max_queue=int(os.getenv('LLM_MAX_QUEUE', 8)),
+                                     timeout_s=float(os.getenv('LLM_QUEUE_TIMEOUT', 30)))
+                 if os.getenv('LLM_MAX_CONCURRENCY') else Unbounded())
+extraction_stats = {"queries": 0, "cache_hits": 0, "rule_hits": 0, "llm_calls": 0, "llm_seconds": 0.0}
+# The query service extracts parameters from several threads at once
+extraction_stats_lock = threading.Lock()
+
+
+def record_extraction(**increments):
+    """Add increments to extraction_stats"""
+    with extraction_stats_lock:
+        for name, value in increments.items():
+            extraction_stats[name] += value
+
+
+def extraction_report() -> Dict[str, Any]:
+    """Share of queries served without the LLM and the estimated LLM time saved"""
+    with extraction_stats_lock:
+        stats = dict(extraction_stats)
+    queries = stats["queries"]
+    without_llm = stats["cache_hits"] + stats["rule_hits"]
+    llm_calls = stats["llm_calls"]
+    avg_llm_seconds = stats["llm_seconds"] / llm_calls if llm_calls else 0.0
+    return {
+        **stats,
+        "share_without_llm": without_llm / queries if queries else 0.0,
+        "avg_llm_seconds": avg_llm_seconds,
+        "estimated_seconds_saved": without_llm * avg_llm_seconds
+    }
+
+
 def format_parks_for_prompt(parks_dict):
     """Helper function to format parks data for the prompt"""
     parks_list = []
@@ -65,7 +118,51 @@ def format_parks_for_prompt(parks_dict):
     return "\n".join(parks_list)
 
 
-def extract_search_parameters(query: str) -> Optional[Dict[str, Any]]:
+def extract_search_parameters(query: str, trace=NULL_TRACE) -> Optional[Dict[str, Any]]:
+    """
+    Extract search parameters from user query
+
+    Cached results are reused, and queries the rule-based extractor covers
+    confidently skip the LLM.
+    """
+    record_extraction(queries=1)
+    cache_key = normalize_query(query)
+
+    cached = search_parameters_cache.get(cache_key)
+    if cached is not None:
+        record_extraction(cache_hits=1)
+        trace.annotate(source="cache")
+        return dict(cached)
+
+    extracted_data = extract_rule_based(query, national_parks)
+    if extracted_data is not None:
+        record_extraction(rule_hits=1)
+        trace.annotate(source="rules")
+    else:
+        record_extraction(llm_calls=1)
+        trace.annotate(source="llm")
+        start = time.perf_counter()
+        extracted_data = extract_search_parameters_llm(query, trace=trace)
+        record_extraction(llm_seconds=time.perf_counter() - start)
+
+    if extracted_data is not None:
+        search_parameters_cache.put(cache_key, dict(extracted_data))
+    return extracted_data
+
+
+def _record_token_counts(response, trace, stats: Optional[Dict[str, Any]] = None):
+    """Copy Ollama's prompt and completion token counts into the trace"""
+    prompt_tokens = response.get('prompt_eval_count') or 0
+    completion_tokens = response.get('eval_count') or 0
+    trace.annotate(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+    trace.add("prompt_tokens", prompt_tokens)
+    trace.add("completion_tokens", completion_tokens)
+    if stats is not None:
+        stats['prompt_tokens'] = prompt_tokens
+        stats['completion_tokens'] = completion_tokens
+
+
+def extract_search_parameters_llm(query: str, trace=NULL_TRACE) -> Optional[Dict[str, Any]]:
     """Extract search parameters from user query using LLM"""
     model_name = "cogito:3b"
 
@@ -93,15 +190,19 @@ User query: {query}
 """
 
     try:
-        response: ChatResponse = chat(
-            model=model_name,
-            messages=[{'role': 'user', 'content': content}],
-            options={'temperature': 0}
-        )
+        with llm_admission.slot():
+            response: ChatResponse = chat(
+                model=model_name,
+                messages=[{'role': 'user', 'content': content}],
+                options={'temperature': 0}
+            )
+        _record_token_counts(response, trace)
 
         if response and response['message']['content']:
             extracted_data = json.loads(response['message']['content'])
             return extracted_data
+    except Overloaded:
+        raise
     except (json.JSONDecodeError, Exception) as e:
         print(f"Error extracting search parameters: {e}")
         return None
@@ -109,52 +210,193 @@ User query: {query}
     return None
 
 
-def search_parks_elasticsearch(search_params: Dict[str, Any], host, api_key) -> List[Dict[str, Any]]:
-    """Execute Elasticsearch searches for relevant parks"""
+def _add_park_context(search_results, park_id, park_info) -> List[Dict[str, Any]]:
+    """Flatten the hit source and tag each result with its park"""
+    park_results = []
+    for result in search_results:
+        result["image_filename"] = result["_source"]["image_filename"]
+        result["generated_description"] = result["_source"]["generated_description"]
+        if RESULT_EMBEDDING_FIELD and RESULT_EMBEDDING_FIELD in result["_source"]:
+            result[RESULT_EMBEDDING_FIELD] = result["_source"][RESULT_EMBEDDING_FIELD]
+        result['park_id'] = park_id
+        result['park_state'] = park_info['state']
+        result['park_coordinates'] = park_info['coordinates']
+        del result["_source"]
+
+        park_results.append(result)
+    return park_results
+
+
+def _prune_parks(spatial_index, relevant_parks, search_distance, park_filters, multi_park_mode, engine, trace):
+    """Drop parks whose search circle holds no indexed photo and tighten the radius of the rest"""
+    try:
+        distance_km = parse_distance_km(search_distance)
+    except ValueError:
+        return relevant_parks, {park_id: search_distance for park_id in relevant_parks}
+
+    with trace.span("spatial_prune"):
+        plan = spatial_index.plan({park_id: national_parks[park_id]['coordinates'] for park_id in relevant_parks},
+                                  distance_km, park_filters)
+        kept = [park_id for park_id in relevant_parks if plan[park_id] is not None]
+        pruned = len(relevant_parks) - len(kept)
+
+        # One request per park, except msearch which sends them together and local searches which send none
+        if engine is not None:
+            round_trips_saved = 0
+        elif multi_park_mode == "msearch":
+            round_trips_saved = 1 if pruned and not kept else 0
+        else:
+            round_trips_saved = pruned
+        trace.annotate(parks_pruned=pruned, parks_searched=len(kept), round_trips_saved=round_trips_saved)
+        trace.add("park_searches_saved", pruned)
+        trace.add("round_trips_saved", round_trips_saved)
+
+    print(f"Spatial index: skipped {pruned} of {len(relevant_parks)} park searches "
+          f"({round_trips_saved} round trips saved), radii {[plan[park_id] for park_id in kept]} km")
+    return kept, {park_id: f"{plan[park_id]:g}km" for park_id in kept}
+
+
+def search_parks_elasticsearch(search_params: Dict[str, Any], host, api_key,
+                               multi_park_mode: str = "sequential", es_client=None,
+                               engine=None, fusion_mode: str = "server",
+                               geo_filter_mode: str = "distance", trace=NULL_TRACE,
+                               use_spatial_index: bool = True) -> List[Dict[str, Any]]:
+    """
+    Execute Elasticsearch searches for relevant parks
+
+    multi_park_mode selects how the per-park searches are sent: "sequential"
+    runs one request per park, "msearch" sends all of them in one _msearch call.
+    es_client defaults to the shared pooled client for host/api_key. When a
+    LocalSearchEngine is passed as engine, the searches run in process instead.
+    fusion_mode "client" runs the retrievers of each park in one _msearch and
+    fuses them locally, printing the took time and hits of each retriever.
+    geo_filter_mode "park" filters on the park_id precomputed from the park
+    boundaries at index time; parks without a boundary keep the distance filter.
+    When the spatial summary written at indexing time is available, parks
+    with no indexed photo in their search circle are skipped and the others
+    searched with the smallest radius reaching all of their photos.
+    Embedding, pruning and per-park search spans are recorded on trace.
+    """
     index_name = os.getenv('ES_INDEX')
+    if engine is None:
+        es_client = es_client or get_es_client(host, api_key)
 
     # Get relevant parks or use all parks if none specified
     relevant_parks = search_params.get('relevant_parks', [])
     if not relevant_parks:
         relevant_parks = list(national_parks.keys())
+    relevant_parks = [park_id for park_id in relevant_parks if park_id in national_parks]
 
     search_text = search_params.get('context_search', '')
     search_distance = f"{search_params.get('distance_km', 100)}km"
 
+    if geo_filter_mode not in ("distance", "park"):
+        raise ValueError(f"Unknown geo_filter_mode: {geo_filter_mode}")
+    shaped_parks = load_park_shapes().park_ids if geo_filter_mode == "park" else set()
+    park_filters = {park_id: park_id if park_id in shaped_parks else None for park_id in relevant_parks}
+
+    park_distances = {park_id: search_distance for park_id in relevant_parks}
+    spatial_index = load_spatial_index() if use_spatial_index else None
+    if spatial_index is not None and relevant_parks:
+        relevant_parks, park_distances = _prune_parks(spatial_index, relevant_parks, search_distance,
+                                                      park_filters, multi_park_mode, engine, trace)
+        if not relevant_parks:
+            return []
+
     print(f"Searching {len(relevant_parks)} parks for: '{search_text}'")
 
-    for park_id in relevant_parks:
-        all_results = []
-        if park_id not in national_parks:
-            continue
+    # Embed the query once and reuse it for every park
+    with trace.span("create_text_embedding"):
+        cache_hit = search_text in clip_processor.text_embedding_cache
+        query_vector = cached_text_embedding(search_text).tolist()
+        trace.annotate(cache_hit=cache_hit)
+        trace.add("embedding_cache_hits" if cache_hit else "embedding_cache_misses")
 
-        park_info = national_parks[park_id]
-        latitude, longitude = park_info['coordinates']
+    all_results = []
 
-        try:
-            # Execute the search for this park
-            search_results = rrf_search(
-                host=host,
-                api_key=api_key,
-                index_name=index_name,
-                lat=latitude,
-                lon=longitude,
-                distance=search_distance,
-                text_query=search_text
-            )
+    if multi_park_mode == "msearch" and engine is None and fusion_mode == "server":
+        searches = []
+        for park_id in relevant_parks:
+            latitude, longitude = national_parks[park_id]['coordinates']
+            searches.append(build_rrf_search(index_name=index_name, lat=latitude, lon=longitude,
+                                             distance=park_distances[park_id], text_query=search_text,
+                                             query_vector=query_vector, park_id=park_filters[park_id]))
 
-            # Add park context to results
-            for result in search_results:
-                result["image_filename"] = result["_source"]["image_filename"]
-                result["generated_description"] = result["_source"]["generated_description"]
-                result['park_id'] = park_id
-                result['park_state'] = park_info['state']
-                result['park_coordinates'] = park_info['coordinates']
-                del result["_source"]
+        try:
+            with trace.span("rrf_multi_search", parks=len(relevant_parks)):
+                responses = rrf_multi_search(host=host, api_key=api_key, index_name=index_name, searches=searches,
+                                             es_client=es_client, trace=trace)
+        except Exception as e:
+            print(f"Error searching parks: {e}")
+            return all_results
+
+        for park_id, search_results in zip(relevant_parks, responses):
+            if search_results is None:
+                print(f"Error searching {park_id}")
+                continue
+            park_results = _add_park_context(search_results, park_id, national_parks[park_id])
+            print(f"Found {len(park_results)} results for {park_id}")
+            all_results.extend(park_results)
+
+        return all_results
+
+    if multi_park_mode not in ("sequential", "msearch"):
+        raise ValueError(f"Unknown multi_park_mode: {multi_park_mode}")
+    if fusion_mode not in ("server", "client"):
+        raise ValueError(f"Unknown fusion_mode: {fusion_mode}")
+    if multi_park_mode == "msearch" and fusion_mode == "client" and engine is None:
+        # Client fusion already sends one _msearch per park for its retrievers
+        print("Warning: multi_park_mode 'msearch' is not supported with fusion_mode 'client', "
+              "searching the parks sequentially")
+        trace.annotate(multi_park_mode="sequential")
 
+    for park_id in relevant_parks:
+        park_info = national_parks[park_id]
+        latitude, longitude = park_info['coordinates']
 
-                all_results.append(result)
-            print(f"Found {len(all_results)} results for {park_id}")
+        try:
+            with trace.span("rrf_search", park_id=park_id):
+                # Execute the search for this park
+                if engine is not None:
+                    search_results = engine.rrf_search(lat=latitude, lon=longitude, distance=park_distances[park_id],
+                                                       text_query=search_text, query_vector=query_vector,
+                                                       park_id=park_filters[park_id])
+                elif fusion_mode == "client":
+                    search_results, retriever_stats = rrf_search_client_fusion(
+                        host=host,
+                        api_key=api_key,
+                        index_name=index_name,
+                        lat=latitude,
+                        lon=longitude,
+                        distance=park_distances[park_id],
+                        text_query=search_text,
+                        query_vector=query_vector,
+                        es_client=es_client,
+                        park_id=park_filters[park_id]
+                    )
+                    print(f"Retriever stats for {park_id}: {retriever_stats}")
+                    trace.annotate(es_took_ms=max((stats['took'] for stats in retriever_stats.values()), default=0),
+                                   retriever_stats=json.dumps(retriever_stats))
+                else:
+                    search_results = rrf_search(
+                        host=host,
+                        api_key=api_key,
+                        index_name=index_name,
+                        lat=latitude,
+                        lon=longitude,
+                        distance=park_distances[park_id],
+                        text_query=search_text,
+                        query_vector=query_vector,
+                        es_client=es_client,
+                        park_id=park_filters[park_id],
+                        trace=trace
+                    )
+
+                # Add park context to results
+                park_results = _add_park_context(search_results, park_id, park_info)
+                trace.annotate(hits=len(park_results))
+                print(f"Found {len(park_results)} results for {park_id}")
+                all_results.extend(park_results)
 
         except Exception as e:
             print(f"Error searching {park_id}: {e}")
@@ -163,28 +405,21 @@ def search_parks_elasticsearch(search_params: Dict[str, Any], host, api_key) ->
     return all_results
 
 
-def generate_response(original_query: str, search_results: List[Dict[str, Any]], search_params: Dict[str, Any]) -> str:
-    """Generate final response using LLM with search results"""
-    model_name = "cogito:3b"
-
-    # Format search results for the prompt
-    if not search_results:
-        results_text = "No results found for your query."
-    else:
-        results_text = "Search Results:\n"
-        for result in search_results:
-            score = result['_score']
-            # Adjust these field names based on your Elasticsearch document structure
-            title = result['image_filename']
-            content_snippet = result['generated_description'][:200] + "..."
-
-            results_text += f"   Title: {title}\n"
-            results_text += f"   Content: {content_snippet}\n"
-            results_text += f"   Relevance Score: {score}\n"
+def build_response_prompt(original_query: str, search_results: List[Dict[str, Any]],
+                          search_params: Dict[str, Any], context_stats: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Build the query-specific part of the answer prompt from the search results
 
-    content = f"""You are a helpful assistant for national parks activities. Based on the search results below, provide a comprehensive and helpful response to the user's original query.
+    The static instructions are sent separately as the system message
+    (see response_messages). Near-duplicate results are pruned and the rest
+    fitted to the token budget by context_builder; its stats are written
+    to context_stats when it is given.
+    """
+    results_text, stats = build_context(search_results, embedding_field=RESULT_EMBEDDING_FIELD or None)
+    if context_stats is not None:
+        context_stats.update(stats)
 
-Original User Query: {original_query}
+    content = f"""Original User Query: {original_query}
 
 Search Parameters Used:
 - Activity/Interest: {search_params.get('context_search', 'N/A')}
@@ -194,50 +429,213 @@ Search Parameters Used:
 
 {results_text}
 
-Instructions:
-- Provide a natural, conversational response
-- Recommend specific activities and locations based on the search results only
-- Include practical information when available
-- Do not suggest alternatives if no results were found
-- Be enthusiastic and helpful about national parks experiences
-- Keep the response focused and not too lengthy
-- Structure your response separating your suggestions per national park
-- Do not include anything about national parks that are not in the results
-
 Response:"""
 
+    return content
+
+
+def response_messages(content: str) -> List[Dict[str, str]]:
+    """Chat messages with the static instructions first, so their KV cache is reused across queries"""
+    return [{'role': 'system', 'content': RESPONSE_INSTRUCTIONS},
+            {'role': 'user', 'content': content}]
+
+
+def _stream_response(content: str, generation_stats: Dict[str, Any], trace=NULL_TRACE) -> Iterator[str]:
+    """Yield answer tokens from Ollama as they are generated, recording timings"""
+    model_name = "cogito:3b"
+    start = time.perf_counter()
+    generated = False
+
     try:
-        response: ChatResponse = chat(
-            model=model_name,
-            messages=[{'role': 'user', 'content': content}],
-            options={'temperature': 0.3}  # Slightly higher temperature for more natural responses
-        )
+        with trace.span("generate_response", stream=True), llm_admission.slot():
+            for chunk in chat(
+                model=model_name,
+                messages=response_messages(content),
+                options={'temperature': 0.3},  # Slightly higher temperature for more natural responses
+                stream=True
+            ):
+                if chunk.get('done'):
+                    _record_token_counts(chunk, trace, generation_stats)
+                token = chunk['message']['content']
+                if not token:
+                    continue
+                if not generated:
+                    generation_stats['time_to_first_token'] = time.perf_counter() - start
+                    trace.annotate(time_to_first_token_ms=1000 * generation_stats['time_to_first_token'])
+                    generated = True
+                yield token
+    except Overloaded:
+        raise
+    except Exception as e:
+        print(f"Error generating response: {e}")
+        generation_stats['failed'] = True
+        yield "I apologize, but I encountered an error while generating a response to your query."
+        return
+    finally:
+        generation_stats['generation_seconds'] = time.perf_counter() - start
+        metrics_registry.record(trace)
+        print(f"Generation stats: {generation_stats}")
+
+    if not generated:
+        generation_stats['failed'] = True
+        yield "I wasn't able to generate a proper response. Please try rephrasing your question."
+
+
+def generate_response(original_query: str, search_results: List[Dict[str, Any]], search_params: Dict[str, Any],
+                      stream: bool = False, generation_stats: Optional[Dict[str, Any]] = None,
+                      trace=NULL_TRACE):
+    """
+    Generate final response using LLM with search results
+
+    With stream=True an iterator of tokens is returned instead of the full
+    text. Time to first token (streaming only), total generation time in
+    seconds, Ollama token counts and the prompt context stats (estimated
+    tokens before and after pruning) are written to generation_stats when it
+    is given, and failed is set when the answer is an error message instead
+    of a generated one. The trace is recorded in the metrics registry once generation
+    has finished.
+    """
+    model_name = "cogito:3b"
+    generation_stats = {} if generation_stats is None else generation_stats
+
+    context_stats = {}
+    with trace.span("build_context"):
+        content = build_response_prompt(original_query, search_results, search_params, context_stats)
+        trace.annotate(**context_stats)
+    generation_stats['context'] = context_stats
+    print(f"Prompt context: {context_stats['results']} -> {context_stats['results_used']} results, "
+          f"~{context_stats['tokens_before']} -> ~{context_stats['tokens_after']} tokens")
+
+    if stream:
+        return _stream_response(content, generation_stats, trace)
+
+    start = time.perf_counter()
+    try:
+        with trace.span("generate_response", stream=False), llm_admission.slot():
+            response: ChatResponse = chat(
+                model=model_name,
+                messages=response_messages(content),
+                options={'temperature': 0.3}  # Slightly higher temperature for more natural responses
+            )
+            _record_token_counts(response, trace, generation_stats)
 
         if response and response['message']['content']:
             return response['message']['content']
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error generating response: {e}")
+        generation_stats['failed'] = True
         return "I apologize, but I encountered an error while generating a response to your query."
+    finally:
+        generation_stats['generation_seconds'] = time.perf_counter() - start
+        metrics_registry.record(trace)
 
+    generation_stats['failed'] = True
     return "I wasn't able to generate a proper response. Please try rephrasing your question."
 
 
-def process_parks_query(user_query: str, host, api_key) -> str:
-    """Main function to process a user query end-to-end"""
+def _cache_streamed_answer(tokens: Iterator[str], cache_key, search_results, namespace,
+                           generation_stats: Dict[str, Any]) -> Iterator[str]:
+    """Pass tokens through and cache the full answer once the stream completes, unless generation failed"""
+    response = ""
+    for token in tokens:
+        response += token
+        yield token
+    if not generation_stats.get('failed'):
+        answer_cache.put(cache_key, (response, search_results), namespace=namespace)
+
+
+def _cached_answer(user_query: str, namespace, trace=NULL_TRACE):
+    """
+    Look up the answer to a near-identical earlier question.
+
+    Returns:
+        tuple: (cached (response, search_results) or None, cache key embedding)
+    """
+    with trace.span("answer_cache"):
+        cache_key = clip_processor.cached_text_embedding(normalize_query(user_query))
+        cached, similarity = answer_cache.get(cache_key, namespace=namespace)
+        trace.annotate(hit=cached is not None, similarity=similarity)
+        trace.add("answer_cache_hits" if cached is not None else "answer_cache_misses")
+    if cached is not None:
+        print(f"Answer cache hit (similarity {similarity:.3f})")
+        metrics_registry.record(trace)
+    return cached, cache_key
+
+
+def process_parks_query(user_query: str, host, api_key, multi_park_mode: str = "sequential",
+                        es_client=None, engine=None, stream: bool = False,
+                        generation_stats: Optional[Dict[str, Any]] = None, trace=NULL_TRACE,
+                        use_answer_cache: bool = True, fusion_mode: str = FUSION_MODE,
+                        geo_filter_mode: str = GEO_FILTER_MODE) -> str:
+    """
+    Main function to process a user query end-to-end
+
+    With stream=True the response is an iterator of tokens, returned as soon
+    as retrieval has finished so the results can be shown during generation.
+    Pass a tracing.Trace to collect per-stage spans, Elasticsearch took
+    times, embedding cache hits and token counts alongside the results.
+    fusion_mode and geo_filter_mode are passed to search_parks_elasticsearch
+    and default to the FUSION_MODE and GEO_FILTER_MODE environment variables.
+
+    Answers are cached by the CLIP embedding of the normalized query, so a
+    repeated or reworded question naming the same places and activity
+    returns the stored (response, search_results) without retrieval or
+    generation, and without extraction when the activity is one of the
+    query_rules.ACTIVITIES. Failed generations are never cached.
+    """
     print(f"Processing query: {user_query}")
+    generation_stats = {} if generation_stats is None else generation_stats
 
-    # Step 1: Extract search parameters
-    search_params = extract_search_parameters(user_query)
-    if not search_params:
-        return "I'm sorry, I couldn't understand your query. Please try rephrasing it."
+    # Step 0: Reuse the answer to a near-identical earlier question about the same places and activity.
+    # When the activity is outside the rule vocabulary the lookup waits for the extracted one
+    cached = namespace = None
+    activities = activity_terms(user_query) if use_answer_cache else frozenset()
+    if activities:
+        namespace = location_terms(user_query, national_parks) | activities
+        cached, cache_key = _cached_answer(user_query, namespace, trace)
 
-    print(f"Extracted parameters: {search_params}")
+    # Step 1: Extract search parameters
+    if cached is None:
+        with trace.span("extract_search_parameters"):
+            search_params = extract_search_parameters(user_query, trace=trace)
+        if not search_params:
+            message = "I'm sorry, I couldn't understand your query. Please try rephrasing it."
+            if stream:
+                return iter([message]), []
+            return message
+
+        print(f"Extracted parameters: {search_params}")
+
+        if use_answer_cache and namespace is None:
+            namespace = location_terms(user_query, national_parks) | {
+                normalize_query(search_params.get('context_search') or '')}
+            cached, cache_key = _cached_answer(user_query, namespace, trace)
+
+    if cached is not None:
+        response, search_results = cached
+        if stream:
+            return iter([response]), search_results
+        return response, search_results
 
     # Step 2: Execute searches across relevant parks
-    search_results = search_parks_elasticsearch(search_params, host, api_key)
+    with trace.span("search_parks_elasticsearch"):
+        search_results = search_parks_elasticsearch(search_params, host, api_key, multi_park_mode=multi_park_mode,
+                                                     es_client=es_client, engine=engine, fusion_mode=fusion_mode,
+                                                     geo_filter_mode=geo_filter_mode, trace=trace)
 
     # Step 3: Generate final response
-    final_response = generate_response(user_query, search_results, search_params)
+    final_response = generate_response(user_query, search_results, search_params, stream=stream,
+                                       generation_stats=generation_stats, trace=trace)
+
+    # Only generated answers grounded in retrieved results are worth serving again
+    if use_answer_cache and search_results:
+        if stream:
+            final_response = _cache_streamed_answer(final_response, cache_key, search_results, namespace,
+                                                    generation_stats)
+        elif not generation_stats.get('failed'):
+            answer_cache.put(cache_key, (final_response, search_results), namespace=namespace)
 
     return final_response, search_results
 
@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+
+class SemanticCache:
+    """
+    Thread-safe cache of answers keyed by normalized query embeddings.
+
+    A lookup is a cosine-similarity scan over the cached embeddings; the best
+    entry is a hit when its similarity reaches the threshold, it has not
+    outlived the TTL and its namespace matches (entries for different places
+    never answer each other, however close the wording). When full, expired
+    entries are dropped first, then the least recently used one.
+    """
+
+    def __init__(self, maxsize=256, threshold=0.95, ttl_seconds=3600, dim=512, history=1000):
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.hit_similarities = deque(maxlen=history)
+        self._embeddings = np.zeros((max(maxsize, 0), dim), dtype=np.float32)
+        self._values = [None] * max(maxsize, 0)
+        self._namespaces = [None] * max(maxsize, 0)
+        self._created = np.full(max(maxsize, 0), -np.inf)
+        self._last_used = np.full(max(maxsize, 0), -np.inf)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return int(self._live(time.monotonic()).sum()) if self.maxsize > 0 else 0
+
+    def _live(self, now):
+        live = np.array([value is not None for value in self._values], dtype=bool)
+        if self.ttl_seconds:
+            live &= now - self._created < self.ttl_seconds
+        return live
+
+    def get(self, embedding, namespace=None):
+        """
+        Find the cached value of the most similar query.
+
+        Args:
+            embedding (np.ndarray): Normalized (dim,) query embedding
+            namespace (hashable): Only entries stored under the same namespace match
+
+        Returns:
+            tuple: (value, similarity), value is None on a miss
+        """
+        if self.maxsize <= 0:
+            return None, 0.0
+        with self._lock:
+            now = time.monotonic()
+            live = self._live(now)
+            live &= np.array([ns == namespace for ns in self._namespaces], dtype=bool)
+            if not live.any():
+                self.misses += 1
+                return None, 0.0
+
+            similarities = np.where(live, self._embeddings @ embedding, -np.inf)
+            slot = int(np.argmax(similarities))
+            similarity = float(similarities[slot])
+            if similarity < self.threshold:
+                self.misses += 1
+                return None, similarity
+
+            self._last_used[slot] = now
+            self.hits += 1
+            self.hit_similarities.append(similarity)
+            return self._values[slot], similarity
+
+    def put(self, embedding, value, namespace=None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            live = self._live(now)
+            if live.all():
+                slot = int(np.argmin(self._last_used))
+                self.evictions += 1
+            else:
+                slot = int(np.argmin(live))
+            self._embeddings[slot] = embedding
+            self._values[slot] = value
+            self._namespaces[slot] = namespace
+            self._created[slot] = now
+            self._last_used[slot] = now
+
+    def clear(self):
+        with self._lock:
+            self._values = [None] * len(self._values)
+            self._namespaces = [None] * len(self._namespaces)
+            self._created[:] = -np.inf
+            self._last_used[:] = -np.inf
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+            self.hit_similarities.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        similarities = np.asarray(self.hit_similarities, dtype=np.float64)
+        distribution = {}
+        if len(similarities):
+            distribution = {"min": float(similarities.min()),
+                            "p10": float(np.percentile(similarities, 10)),
+                            "p50": float(np.percentile(similarities, 50)),
+                            "max": float(similarities.max())}
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "threshold": self.threshold,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "hit_similarity": distribution
+        }
@@ -0,0 +1,132 @@
+"""
+Compare the CLIP inference backends on the images_metadata corpus.
+
+For every backend it reports the latency per item and throughput of the
+text and image encoders, and the cosine drift of its embeddings from the
+fp32 eager PyTorch reference, then the max drift at several batch sizes
+for every other backend. Run from the repository root:
+
+    python benchmarks/backend_benchmark.py [backend ...]
+"""
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import clip_processor
+from clip_backends import BACKENDS
+
+
+# Batch sizes and corpus prefix of the shape sweep
+SWEEP_BATCH_SIZES = (1, 5, clip_processor.DEFAULT_BATCH_SIZE)
+SWEEP_LIMIT = 64
+
+
+def load_corpus(metadata_dir=os.path.join(REPO_ROOT, 'images_metadata'), corpus_pack=os.getenv('CORPUS_PACK')):
+    if corpus_pack:
+        # One sequential read of the packed columns instead of a file open per document
+        from corpus_pack import CorpusPack
+
+        pack = CorpusPack(corpus_pack)
+        return (pack.strings('generated_description'),
+                [os.path.join(metadata_dir, filename) for filename in pack.strings('image_filename')])
+
+    texts, image_paths = [], []
+    for json_file in sorted(os.listdir(metadata_dir)):
+        if not json_file.endswith('.json'):
+            continue
+        with open(os.path.join(metadata_dir, json_file), 'r') as file:
+            data = json.load(file)
+        texts.append(data['generated_description'])
+        image_paths.append(os.path.join(metadata_dir, data['image_filename']))
+    return texts, image_paths
+
+
+def _normalize(embeddings):
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+
+def cosine_drift(embeddings, reference):
+    """Per-row 1 - cosine similarity between two embedding matrices"""
+    return 1.0 - np.sum(_normalize(embeddings) * _normalize(reference), axis=1)
+
+
+def run_backend(name, texts, image_paths):
+    """
+    Embed the corpus with one backend.
+
+    Returns:
+        dict: Timings plus the text and image embeddings
+    """
+    clip_processor.set_backend(name)
+    clip_processor.warm_up(text=True, image=True)
+
+    start = time.perf_counter()
+    text_embeddings = clip_processor.create_text_embeddings(texts)
+    text_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    image_embeddings = clip_processor.create_image_embeddings(image_paths)
+    image_s = time.perf_counter() - start
+
+    return {"text_s": text_s, "image_s": image_s, "text": text_embeddings, "image": image_embeddings}
+
+
+def shape_sweep(name, texts, image_paths, reference, batch_sizes=SWEEP_BATCH_SIZES, limit=SWEEP_LIMIT):
+    """
+    Max cosine drift from the reference at several batch sizes.
+
+    Exported and traced graphs can be specialized to the shapes they were
+    built with, so the corpus run at one batch size is not enough to show a
+    backend is correct at every batch size and text length.
+
+    Returns:
+        dict: (max text drift, max image drift) per batch size
+    """
+    clip_processor.set_backend(name)
+    texts, image_paths = texts[:limit], image_paths[:limit]
+    drift = {}
+    for batch_size in batch_sizes:
+        text = clip_processor.create_text_embeddings(texts, batch_size=batch_size)
+        image = clip_processor.create_image_embeddings(image_paths, batch_size=batch_size)
+        drift[batch_size] = (cosine_drift(text, reference["text"][:limit]).max(),
+                             cosine_drift(image, reference["image"][:limit]).max())
+    return drift
+
+
+def main(backends):
+    texts, image_paths = load_corpus()
+    print(f"Corpus: {len(texts)} descriptions, {len(image_paths)} images")
+
+    reference = run_backend("torch", texts, image_paths)
+    print(f"{'backend':<13}{'text ms/item':>14}{'text items/s':>14}{'image ms/item':>15}{'image items/s':>15}"
+          f"{'text drift mean/max':>22}{'image drift mean/max':>23}")
+
+    for name in backends:
+        result = reference if name == "torch" else run_backend(name, texts, image_paths)
+        text_drift = cosine_drift(result["text"], reference["text"])
+        image_drift = cosine_drift(result["image"], reference["image"])
+        print(f"{name:<13}"
+              f"{1000 * result['text_s'] / len(texts):>14.2f}{len(texts) / result['text_s']:>14.1f}"
+              f"{1000 * result['image_s'] / len(image_paths):>15.2f}{len(image_paths) / result['image_s']:>15.1f}"
+              f"{text_drift.mean():>13.2e}/{text_drift.max():.2e}"
+              f"{image_drift.mean():>14.2e}/{image_drift.max():.2e}")
+
+    print(f"\nMax drift by batch size over the first {SWEEP_LIMIT} items (text / image)")
+    for name in backends:
+        if name == "torch":
+            continue
+        drift = shape_sweep(name, texts, image_paths, reference)
+        print(f"{name:<13}" + "".join(f"  batch {batch_size}: {text:.2e} / {image:.2e}"
+                                      for batch_size, (text, image) in drift.items()))
+
+    clip_processor.set_backend(os.getenv('CLIP_BACKEND', 'torch'))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or list(BACKENDS))
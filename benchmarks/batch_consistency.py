@@ -0,0 +1,63 @@
+"""
+Check that batched CLIP embeddings match single-item embeddings.
+
+Embeds the corpus descriptions and images once with the batch API and
+once item by item through the single-item wrappers, and compares every
+row. Texts are padded to the same length in both and the projections run
+row by row, so the rows must be bit-identical; exits with status 1 when
+any differs. The int8 backend quantizes activations per batch and cannot
+match exactly, so compare it with a --tolerance. Run from the repository root:
+
+    python benchmarks/batch_consistency.py --batch-size 32
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import clip_processor
+from backend_benchmark import cosine_drift, load_corpus
+
+
+def compare(name, batched, single, tolerance):
+    """
+    Report the difference between batched and single-item embeddings.
+
+    Returns:
+        list: Row indices whose max absolute difference exceeds the tolerance (0: any difference)
+    """
+    max_abs = np.abs(batched - single).max(axis=1)
+    drift = cosine_drift(batched, single)
+    print(f"{name}: {len(batched)} rows, max abs diff {max_abs.max():.2e}, "
+          f"max cosine drift {drift.max():.2e}, bit-identical rows {int((max_abs == 0).sum())}")
+    return [int(i) for i in np.flatnonzero(max_abs > tolerance)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--batch-size", type=int, default=clip_processor.DEFAULT_BATCH_SIZE)
+    parser.add_argument("--limit", type=int, help="Number of corpus items to compare")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="Maximum absolute difference per element")
+    args = parser.parse_args()
+
+    texts, image_paths = load_corpus()
+    texts, image_paths = texts[:args.limit], image_paths[:args.limit]
+    clip_processor.warm_up(text=True, image=True)
+
+    batched_texts = clip_processor.create_text_embeddings(texts, batch_size=args.batch_size)
+    single_texts = np.array([clip_processor.create_text_embedding(text) for text in texts])
+    batched_images = clip_processor.create_image_embeddings(image_paths, batch_size=args.batch_size)
+    single_images = np.array([clip_processor.create_image_embedding(path) for path in image_paths])
+
+    failures = compare("text", batched_texts, single_texts, args.tolerance)
+    failures += compare("image", batched_images, single_images, args.tolerance)
+    print(f"tolerance {args.tolerance:g}: {len(failures)} rows above it")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
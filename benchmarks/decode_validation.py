@@ -0,0 +1,74 @@
+"""
+Validate the fast JPEG decode path against the reference image preprocessing.
+
+Embeds the corpus images with CLIP_IMAGE_DECODE=reference (full decode and
+CLIPImageProcessor) and with the fast path (draft-mode decode and NumPy batch
+normalization), reports decode time per image and throughput of both, and
+the cosine similarity between the two sets of embeddings. Exits with status
+1 when any image falls below the tolerance. Run from the repository root:
+
+    python benchmarks/decode_validation.py --limit 200 --tolerance 0.995
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+import clip_processor
+
+
+def image_paths(metadata_dir=os.path.join(REPO_ROOT, 'images_metadata'), limit=None):
+    paths = sorted(os.path.join(metadata_dir, file) for file in os.listdir(metadata_dir)
+                   if file.lower().endswith(('.jpg', '.jpeg')))
+    return paths[:limit]
+
+
+def time_decode(load, paths):
+    start = time.perf_counter()
+    for path in paths:
+        load(path)
+    return 1000 * (time.perf_counter() - start) / len(paths)
+
+
+def embed(paths, mode):
+    clip_processor.IMAGE_DECODE = mode
+    start = time.perf_counter()
+    embeddings = clip_processor.create_image_embeddings(paths)
+    return embeddings, len(paths) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--limit", type=int, help="Number of images to compare")
+    parser.add_argument("--tolerance", type=float, default=0.995, help="Minimum cosine similarity per image")
+    args = parser.parse_args()
+
+    paths = image_paths(limit=args.limit)
+    clip_processor.warm_up(text=False, image=True)
+
+    print(f"decode reference: {time_decode(clip_processor._load_image, paths):.1f} ms/image")
+    print(f"decode fast:      {time_decode(clip_processor._load_image_fast, paths):.1f} ms/image")
+
+    reference, reference_rate = embed(paths, "reference")
+    fast, fast_rate = embed(paths, "fast")
+    print(f"embedding throughput: reference {reference_rate:.1f} images/s, fast {fast_rate:.1f} images/s")
+
+    reference /= np.linalg.norm(reference, axis=1, keepdims=True)
+    fast /= np.linalg.norm(fast, axis=1, keepdims=True)
+    similarity = np.sum(reference * fast, axis=1)
+    print(f"cosine similarity over {len(paths)} images: min {similarity.min():.5f}, "
+          f"mean {similarity.mean():.5f}, tolerance {args.tolerance}")
+
+    failures = [path for path, value in zip(paths, similarity) if value < args.tolerance]
+    for path in failures:
+        print(f"below tolerance: {os.path.basename(path)}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+End-to-end latency benchmark of the query pipeline with local stand-ins.
+
+A fake Ollama server answers /api/chat after a configurable delay, and
+retrieval runs on LocalSearchEngine over the in-repo corpus, so no
+external service is needed. CLIP runs for real. The fixed query set is
+run by N concurrent simulated users through process_parks_query itself,
+so answer cache, spatial pruning and context building run as in the app;
+p50/p95/p99 are reported per trace span (answer cache, extraction,
+spatial pruning, embedding, retrieval per park, context, generation) and
+in total, and the results are written as JSON for regression comparisons.
+Estimated prompt tokens before and after context pruning are reported too;
+rerun with a huge --prompt-token-budget and --duplicate-threshold 1.1 to
+measure generation without pruning. Run from the repository root:
+
+    python benchmarks/e2e_benchmark.py --users 4 --repeats 3
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from tracing import Trace
+
+
+QUERIES = [
+    "Where can I hike in Utah?",
+    "Dog-friendly trails near Boston",
+    "Best camping spots in Wyoming",
+    "Photography locations in national parks",
+    "Where can I see geysers erupt?",
+    "Waterfalls to visit in Alaska",
+    "Scenic overlooks at the Grand Canyon",
+    "Lakes to kayak on near Portland",
+    "Civil war history sites near Washington DC",
+    "Wildflower hikes in Montana"
+]
+
+FAKE_PARAMETERS = {"context_search": "hike", "distance_km": 100, "location_type": None,
+                   "reference_location": None, "relevant_parks": []}
+FAKE_ANSWER = "Here are some great options based on the search results. " * 8
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    """Minimal /api/chat endpoint returning canned answers after a delay"""
+    latency_s = 0.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        prompt = body['messages'][-1]['content']
+        content = json.dumps(FAKE_PARAMETERS) if "Extract the following information" in prompt else FAKE_ANSWER
+        time.sleep(self.latency_s)
+
+        message = {"model": body['model'], "created_at": "2025-01-01T00:00:00Z",
+                   "message": {"role": "assistant", "content": content}, "done": True,
+                   "prompt_eval_count": len(prompt) // 4, "eval_count": len(content) // 4}
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson" if body.get('stream') else "application/json")
+        self.end_headers()
+        if body.get('stream'):
+            for word in content.split(" "):
+                chunk = dict(message, message={"role": "assistant", "content": word + " "}, done=False)
+                self.wfile.write((json.dumps(chunk) + "\n").encode())
+        self.wfile.write((json.dumps(message) + "\n").encode())
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_fake_ollama(latency_s):
+    FakeOllamaHandler.latency_s = latency_s
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeOllamaHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_query(query, engine, conversation):
+    """
+    Run one query through process_parks_query, as the app does, and read the stage times from its trace.
+
+    Returns:
+        dict: Total seconds, seconds per span name, one retrieval entry per park
+        searched, prompt context stats and trace counters
+    """
+    trace = Trace()
+    generation_stats = {}
+    start = time.perf_counter()
+    conversation.process_parks_query(query, None, None, engine=engine, generation_stats=generation_stats, trace=trace)
+    total = time.perf_counter() - start
+
+    return {
+        "total": total,
+        "stages": {name: duration_ms / 1000 for name, duration_ms in trace.stage_durations().items()},
+        "retrieval_per_park": [span["duration_ms"] / 1000 for span in trace.spans if span["name"] == "rrf_search"],
+        "context": generation_stats.get('context', {}),
+        "counters": trace.counters
+    }
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=np.float64) * 1000
+    if not len(values):
+        return {}
+    return {"count": int(len(values)), "mean_ms": float(values.mean()),
+            "p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95)),
+            "p99_ms": float(np.percentile(values, 99))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--users", type=int, default=1, help="Concurrent simulated users")
+    parser.add_argument("--repeats", type=int, default=3, help="Passes over the query set per user")
+    parser.add_argument("--llm-latency-ms", type=float, default=200, help="Fake Ollama response delay")
+    parser.add_argument("--warm-caches", action="store_true", help="Keep extraction and embedding caches")
+    parser.add_argument("--prompt-token-budget", type=int, help="Override PROMPT_TOKEN_BUDGET")
+    parser.add_argument("--duplicate-threshold", type=float, help="Override DUPLICATE_THRESHOLD")
+    parser.add_argument("--corpus-pack", default=os.getenv('CORPUS_PACK'),
+                        help="Load the corpus from a pack built by corpus_pack.py instead of images_metadata/")
+    parser.add_argument("--output", default=os.path.join("benchmark_results", "e2e.json"))
+    args = parser.parse_args()
+
+    server = start_fake_ollama(args.llm_latency_ms / 1000)
+    # The ollama client reads OLLAMA_HOST when it is first imported
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{server.server_address[1]}"
+    if args.prompt_token_budget is not None:
+        os.environ["PROMPT_TOKEN_BUDGET"] = str(args.prompt_token_budget)
+    if args.duplicate_threshold is not None:
+        os.environ["DUPLICATE_THRESHOLD"] = str(args.duplicate_threshold)
+
+    import clip_processor
+    import LLM_conversation as conversation
+    from embedding_store import EmbeddingStore
+    from local_search import LocalSearchEngine
+
+    if args.corpus_pack:
+        engine = LocalSearchEngine.from_corpus_pack(args.corpus_pack)
+    else:
+        engine = LocalSearchEngine.from_metadata(os.path.join(REPO_ROOT, 'images_metadata/'),
+                                                 store=EmbeddingStore(os.getenv('EMBEDDING_STORE', 'embedding_store')))
+    conversation.cached_text_embedding("warm up")
+
+    def user_session(_):
+        runs = []
+        for _ in range(args.repeats):
+            for query in QUERIES:
+                if not args.warm_caches:
+                    conversation.search_parameters_cache.clear()
+                    conversation.answer_cache.clear()
+                    clip_processor.text_embedding_cache.clear()
+                runs.append(run_query(query, engine, conversation))
+        return runs
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.users) as pool:
+        runs = [run for session in pool.map(user_session, range(args.users)) for run in session]
+    wall_s = time.perf_counter() - start
+    server.shutdown()
+
+    # Span names in the order they first occur; stages a query skipped (e.g. on an answer cache hit) are
+    # summarized over the queries that ran them
+    stages = list(dict.fromkeys(name for run in runs for name in run["stages"]))
+    counters = {}
+    for run in runs:
+        for name, value in run["counters"].items():
+            counters[name] = counters.get(name, 0) + value
+    report = {
+        "config": vars(args),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "queries": len(runs),
+        "wall_seconds": wall_s,
+        "throughput_qps": len(runs) / wall_s,
+        "stages": {**{stage: percentiles([run["stages"][stage] for run in runs if stage in run["stages"]])
+                      for stage in stages},
+                   "total": percentiles([run["total"] for run in runs])},
+        "retrieval_per_park": percentiles([t for run in runs for t in run["retrieval_per_park"]]),
+        "prompt_context": {key: float(np.mean([run["context"].get(key, 0) for run in runs]))
+                           for key in ("results", "results_used", "tokens_before", "tokens_after")},
+        "counters": counters
+    }
+
+    print(f"{'stage':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for stage, stats in list(report["stages"].items()) + [("retrieval_per_park", report["retrieval_per_park"])]:
+        if stats:
+            print(f"{stage:<28}{stats['count']:>7}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}"
+                  f"{stats['p99_ms']:>10.2f}")
+    print(f"counters: {counters}")
+    context = report["prompt_context"]
+    print(f"prompt context: {context['results']:.1f} -> {context['results_used']:.1f} results, "
+          f"~{context['tokens_before']:.0f} -> ~{context['tokens_after']:.0f} tokens per query")
+    print(f"{len(runs)} queries by {args.users} users in {wall_s:.2f}s ({report['throughput_qps']:.2f} queries/s)")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Scaling report of the process-pool ingestion mode.
+
+Embeds the same metadata files (CLIP text and image towers plus thumbnails)
+with several workers x threads-per-worker layouts and reports docs/s
+against the number of cores used, with the speedup over one single-threaded
+worker. Nothing is sent to Elasticsearch, the embedding store is not used
+and every layout writes its thumbnails into a fresh directory, so every run
+does the full inference and thumbnail work.
+
+Startup is reported apart from throughput: the time to spawn the pool and
+import the pipeline in every worker, the time until each worker has
+returned its first batch (spawn, model load and one batch), the model load
+estimated from the two, and the steady-state docs/s after that first
+round, which the speedups are computed from. Run from the repository root:
+
+    python benchmarks/ingest_scaling.py --docs 256 --layouts 1x1 1x4 2x2 4x1
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from upload_documents import generate_actions_multiprocess, list_metadata_files
+
+
+def default_layouts(cores):
+    """1 x cores, 2 x cores/2, ... cores x 1, plus a single-threaded baseline"""
+    layouts = [(1, 1)]
+    workers = 1
+    while workers <= cores:
+        layouts.append((workers, cores // workers))
+        workers *= 2
+    return list(dict.fromkeys(layouts))
+
+
+def _worker_ready(_):
+    return os.getpid()
+
+
+def measure_spawn(workers):
+    """Seconds to start a spawn pool whose workers have imported the ingestion pipeline"""
+    start = time.perf_counter()
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        pool.map(_worker_ready, range(workers))
+    return time.perf_counter() - start
+
+
+def run_layout(metadata_files, workers, threads_per_worker, batch_size):
+    spawn_s = measure_spawn(workers)
+
+    stats = {'docs': 0, 'bytes': 0}
+    # Workers inherit THUMBNAIL_DIR when they are spawned, so no layout reuses another's thumbnails
+    previous_thumbnail_dir = os.environ.get('THUMBNAIL_DIR')
+    with tempfile.TemporaryDirectory(prefix="ingest-scaling-thumbnails-") as thumbnail_dir:
+        os.environ['THUMBNAIL_DIR'] = thumbnail_dir
+        try:
+            # Every worker's first batch pays for its model load
+            first_round = min(workers * batch_size, len(metadata_files))
+            start = time.perf_counter()
+            first_round_s = None
+            for _ in generate_actions_multiprocess(metadata_files, "scaling-benchmark", stats, workers,
+                                                   threads_per_worker=threads_per_worker, batch_size=batch_size):
+                if stats['docs'] == first_round:
+                    first_round_s = time.perf_counter() - start
+            elapsed = time.perf_counter() - start
+        finally:
+            if previous_thumbnail_dir is None:
+                os.environ.pop('THUMBNAIL_DIR', None)
+            else:
+                os.environ['THUMBNAIL_DIR'] = previous_thumbnail_dir
+
+    first_round_s = elapsed if first_round_s is None else first_round_s
+    steady_docs = stats['docs'] - first_round
+    steady_s = elapsed - first_round_s
+    steady_rate = steady_docs / steady_s if steady_docs and steady_s > 0 else None
+    # The first round is spawn + model load + one batch per worker at the steady rate
+    model_load_s = (max(0.0, first_round_s - spawn_s - first_round / steady_rate) if steady_rate
+                    else None)
+    return {"workers": workers, "threads_per_worker": threads_per_worker, "cores": workers * threads_per_worker,
+            "docs": stats['docs'], "seconds": elapsed, "spawn_seconds": spawn_s,
+            "first_round_seconds": first_round_s, "model_load_seconds_estimate": model_load_s,
+            "steady_docs": steady_docs, "docs_per_second": steady_rate,
+            "docs_per_second_overall": stats['docs'] / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--docs", type=int, default=256, help="Metadata files embedded per layout")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--layouts", nargs="+", help="WORKERSxTHREADS layouts, defaults to powers of two")
+    parser.add_argument("--output", default=os.path.join("benchmark_results", "ingest_scaling.json"))
+    args = parser.parse_args()
+
+    os.chdir(REPO_ROOT)
+    metadata_files = sorted(list_metadata_files('images_metadata/'))[:args.docs]
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    layouts = ([tuple(int(part) for part in layout.split('x')) for layout in args.layouts] if args.layouts
+               else default_layouts(cores))
+
+    results = []
+    for workers, threads_per_worker in layouts:
+        results.append(run_layout(metadata_files, workers, threads_per_worker, args.batch_size))
+
+    baseline = next((result["docs_per_second"] for result in results if result["cores"] == 1), None)
+    print(f"{'layout':<10}{'cores':>6}{'spawn s':>9}{'1st round s':>13}{'load s (est)':>14}"
+          f"{'steady docs/s':>15}{'speedup':>9}{'overall docs/s':>16}")
+    for result in results:
+        rate = result["docs_per_second"]
+        result["speedup"] = rate / baseline if baseline and rate else None
+        speedup = f"{result['speedup']:.2f}x" if result["speedup"] else "-"
+        load = result["model_load_seconds_estimate"]
+        print(f"{result['workers']}x{result['threads_per_worker']:<8}{result['cores']:>6}"
+              f"{result['spawn_seconds']:>9.2f}{result['first_round_seconds']:>13.2f}"
+              f"{f'{load:.2f}' if load is not None else '-':>14}{f'{rate:.1f}' if rate else '-':>15}"
+              f"{speedup:>9}{result['docs_per_second_overall']:>16.1f}")
+    print("Steady-state docs/s exclude each worker's first batch; raise --docs when it shows '-'")
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, 'w') as file:
+        json.dump({"available_cores": cores, "docs": len(metadata_files), "results": results}, file, indent=2)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Import time and peak RSS report for each entry point.
+
+Every measurement runs in a fresh interpreter, so nothing is shared
+between entry points. It also records whether importing the entry point
+pulled in torch or transformers, which the lazy encoders should prevent.
+--import-only skips the warm-up columns, which need the CLIP weights.
+Run from the repository root:
+
+    python benchmarks/startup_report.py [--import-only]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = ["clip_processor", "rag_search_execution", "LLM_conversation", "streamlit_app",
+                "upload_documents", "query_service"]
+
+MEASURE_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import {module}
+result = {{"import_s": time.perf_counter() - start,
+          "import_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+          "torch_imported": "torch" in sys.modules, "transformers_imported": "transformers" in sys.modules}}
+
+if {warm_up}:
+    import clip_processor
+    start = time.perf_counter()
+    clip_processor.warm_up(text=True, image={image})
+    result.update(warm_up_s=time.perf_counter() - start,
+                  warm_up_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+print(json.dumps(result))
+"""
+
+
+def measure(module, image=False, warm_up=True):
+    """
+    Measure one entry point in a fresh interpreter.
+
+    Args:
+        module (str): Module to import
+        image (bool): Also warm up the image encoder
+        warm_up (bool): Warm up the encoders after the import
+
+    Returns:
+        dict: Import (and warm-up) time in seconds, peak RSS in KB and whether torch/transformers were imported
+    """
+    script = MEASURE_SCRIPT.format(module=module, image=image, warm_up=warm_up)
+    result = subprocess.run([sys.executable, "-c", script], cwd=REPO_ROOT, capture_output=True, text=True,
+                            check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--import-only", action="store_true", help="Skip the encoder warm-up")
+    args = parser.parse_args()
+
+    if args.import_only:
+        print(f"{'entry point':<22}{'import s':>10}{'import MB':>11}{'torch':>7}{'transformers':>14}")
+        for module in ENTRY_POINTS:
+            result = measure(module, warm_up=False)
+            print(f"{module:<22}{result['import_s']:>10.2f}{result['import_rss_kb'] / 1024:>11.0f}"
+                  f"{'yes' if result['torch_imported'] else 'no':>7}"
+                  f"{'yes' if result['transformers_imported'] else 'no':>14}")
+        return
+
+    print(f"{'entry point':<22}{'import s':>10}{'import MB':>11}{'text warm s':>13}{'text MB':>9}"
+          f"{'+image s':>10}{'+image MB':>11}")
+    for module in ENTRY_POINTS:
+        text_only = measure(module)
+        with_image = measure(module, image=True)
+        print(f"{module:<22}{text_only['import_s']:>10.2f}{text_only['import_rss_kb'] / 1024:>11.0f}"
+              f"{text_only['warm_up_s']:>13.2f}{text_only['warm_up_rss_kb'] / 1024:>9.0f}"
+              f"{with_image['warm_up_s']:>10.2f}{with_image['warm_up_rss_kb'] / 1024:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import os
+import torch
+
+from clip_processor import TEXT_MAX_LENGTH
+
+
+BACKENDS = ("torch", "int8", "torchscript", "onnx")
+ONNX_CACHE_DIR = os.getenv('CLIP_ONNX_CACHE', 'onnx_models')
+# Max absolute difference accepted between a traced graph and the eager module
+TRACE_TOLERANCE = 1e-4
+
+
+def _project_rows(features, projection):
+    """
+    Apply a bias-free projection to each row on its own.
+
+    One matmul over the whole batch picks its kernel by the number of rows,
+    so an item embedded alone and in a batch differs in the last bits. A
+    batched matmul of one-row products gives every row the same kernel.
+    """
+    if not isinstance(projection, torch.nn.Linear):
+        # Dynamically quantized layers scale activations per batch, so rows depend on each other anyway
+        return projection(features)
+    return torch.bmm(features.unsqueeze(1), projection.weight.t().expand(features.shape[0], -1, -1)).squeeze(1)
+
+
+class _TextEmbeds(torch.nn.Module):
+    def __init__(self, text_model):
+        super().__init__()
+        self.text_model = text_model
+
+    def forward(self, input_ids, attention_mask):
+        pooled = self.text_model.text_model(input_ids=input_ids, attention_mask=attention_mask).pooler_output
+        return _project_rows(pooled, self.text_model.text_projection)
+
+
+class _ImageEmbeds(torch.nn.Module):
+    def __init__(self, vision_model):
+        super().__init__()
+        self.vision_model = vision_model
+
+    def forward(self, pixel_values):
+        pooled = self.vision_model.vision_model(pixel_values=pixel_values).pooler_output
+        return _project_rows(pooled, self.vision_model.visual_projection)
+
+
+def _example_text_inputs(batch_size=2, length=TEXT_MAX_LENGTH):
+    return torch.ones((batch_size, length), dtype=torch.long), torch.ones((batch_size, length), dtype=torch.long)
+
+
+def _example_image_inputs(batch_size=2):
+    return (torch.zeros((batch_size, 3, 224, 224), dtype=torch.float32),)
+
+
+def _quantize(module):
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def _trace(module, example_inputs, check_inputs=()):
+    """
+    Trace and freeze a module.
+
+    A traced graph is only guaranteed at the traced shapes, so it is run
+    against the eager module on check_inputs (other batch sizes) and
+    rejected when the outputs differ. The graph is not passed through
+    torch.jit.optimize_for_inference: its oneDNN rewrite picks kernels by
+    batch size again, and a text would then embed differently alone than in
+    a batch.
+    """
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(module, example_inputs, strict=False))
+        for inputs in check_inputs:
+            difference = (traced(*inputs) - module(*inputs)).abs().max().item()
+            if difference > TRACE_TOLERANCE:
+                raise RuntimeError(f"Traced graph differs from eager by {difference:.2e} at input shapes "
+                                   f"{[tuple(tensor.shape) for tensor in inputs]}")
+    return traced
+
+
+def _onnx_session(module, example_inputs, input_names, output_name, path):
+    try:
+        import onnxruntime
+    except ImportError as e:
+        raise ImportError("The onnx CLIP backend requires onnxruntime (pip install onnxruntime)") from e
+
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        dynamic_axes = {name: {0: "batch", 1: "sequence"} if name != "pixel_values" else {0: "batch"}
+                        for name in input_names}
+        dynamic_axes[output_name] = {0: "batch"}
+        with torch.no_grad():
+            torch.onnx.export(module, example_inputs, path, input_names=list(input_names),
+                              output_names=[output_name], dynamic_axes=dynamic_axes, opset_version=17)
+
+    session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+
+    def run(*inputs):
+        feeds = {name: tensor.numpy() for name, tensor in zip(input_names, inputs)}
+        return torch.from_numpy(session.run([output_name], feeds)[0])
+
+    return run
+
+
+def _onnx_path(model_name, tower):
+    return os.path.join(ONNX_CACHE_DIR, model_name.replace('/', '__'), f"{tower}.onnx")
+
+
+def build_text_encoder(text_model, backend, model_name):
+    """
+    Wrap a CLIPTextModelWithProjection in the requested inference backend.
+
+    Args:
+        text_model: Loaded fp32 CLIPTextModelWithProjection in eval mode
+        backend (str): One of BACKENDS
+        model_name (str): Model name, used to locate exported graphs
+
+    Returns:
+        callable: encode(input_ids, attention_mask) -> (N, 512) torch.Tensor of unnormalized features
+    """
+    module = _TextEmbeds(text_model).eval()
+    if backend == "torch":
+        return module
+    if backend == "int8":
+        return _quantize(module)
+    if backend == "torchscript":
+        return _trace(module, _example_text_inputs(), [_example_text_inputs(1), _example_text_inputs(5)])
+    if backend == "onnx":
+        return _onnx_session(module, _example_text_inputs(), ("input_ids", "attention_mask"), "text_embeds",
+                             _onnx_path(model_name, "text"))
+    raise ValueError(f"Unknown CLIP backend: {backend}. Expected one of {BACKENDS}")
+
+
+def build_image_encoder(vision_model, backend, model_name):
+    """
+    Wrap a CLIPVisionModelWithProjection in the requested inference backend.
+
+    Args:
+        vision_model: Loaded fp32 CLIPVisionModelWithProjection in eval mode
+        backend (str): One of BACKENDS
+        model_name (str): Model name, used to locate exported graphs
+
+    Returns:
+        callable: encode(pixel_values) -> (N, 512) torch.Tensor of image features
+    """
+    module = _ImageEmbeds(vision_model).eval()
+    if backend == "torch":
+        return module
+    if backend == "int8":
+        return _quantize(module)
+    if backend == "torchscript":
+        return _trace(module, _example_image_inputs(), [_example_image_inputs(1), _example_image_inputs(5)])
+    if backend == "onnx":
+        return _onnx_session(module, _example_image_inputs(), ("pixel_values",), "image_embeds",
+                             _onnx_path(model_name, "image"))
+    raise ValueError(f"Unknown CLIP backend: {backend}. Expected one of {BACKENDS}")
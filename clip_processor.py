@@ -1,71 +1,399 @@
-import torch
-from torchvision import transforms
 from PIL import Image
 import os
 import json
-from transformers import CLIPModel, CLIPProcessor
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from index_manifest import hash_file, hash_text
+from concurrency import MicroBatcher
+from lru_cache import LRUCache
+from park_shapes import load_park_shapes
 
 
 model_name = "openai/clip-vit-base-patch32"
-processor = CLIPProcessor.from_pretrained(model_name)
-model = CLIPModel.from_pretrained(model_name)
-model.eval()
 
-# Set up image transformation
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
- #   transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-])
+# Inference backend for both encoders, see clip_backends.BACKENDS
+backend = os.getenv('CLIP_BACKEND', 'torch')
 
+# The text and image encoders are loaded separately on first use, so the
+# query path never pays for the vision tower
+_text_encoder = None
+_image_encoder = None
+_model_lock = threading.Lock()
 
+# Batching defaults for the embedding engine
+EMBEDDING_DIM = 512
+DEFAULT_BATCH_SIZE = int(os.getenv('CLIP_BATCH_SIZE', 32))
+DEFAULT_PREFETCH_BATCHES = 2
+DEFAULT_DECODE_WORKERS = 4
+
+# Every text is padded to CLIP's full context length: attention kernels round differently
+# at different padded lengths, and traced graphs are only guaranteed at the traced length
+TEXT_MAX_LENGTH = 77
+
+# "reference" runs every full-size image through CLIPImageProcessor; "fast"
+# decodes JPEGs at reduced resolution and preprocesses whole batches in NumPy.
+# Check fast against reference with benchmarks/decode_validation.py before switching
+IMAGE_DECODE = os.getenv('CLIP_IMAGE_DECODE', 'reference')
+
+# Query text embeddings reused across searches
+text_embedding_cache = LRUCache(maxsize=int(os.getenv('TEXT_EMBEDDING_CACHE_SIZE', 1024)))
+
+# Collects concurrent query embeddings into batches once enable_text_batching is called
+text_batcher = None
+
+
+def set_backend(name):
+    """
+    Switch the inference backend; encoders are reloaded on next use.
+
+    Args:
+        name (str): One of clip_backends.BACKENDS
+    """
+    global backend, _text_encoder, _image_encoder
+    with _model_lock:
+        backend = name
+        _text_encoder = None
+        _image_encoder = None
+    text_embedding_cache.clear()
+
+
+def embedding_model_key():
+    """Name recorded with stored text embeddings, so vectors from different backends never mix"""
+    return model_name if backend == "torch" else f"{model_name}@{backend}"
+
+
+def image_embedding_model_key():
+    """
+    Name recorded with stored image embeddings, which also depend on the decode path.
+
+    A document carries both embeddings, so index manifests and corpus packs
+    record this key too.
+    """
+    key = embedding_model_key()
+    return key if IMAGE_DECODE == "reference" else f"{key}+{IMAGE_DECODE}"
+
+
+def get_text_encoder():
+    """
+    Load the CLIP tokenizer and text tower once, thread-safely.
+
+    Returns:
+        tuple: (tokenizer, encode(input_ids, attention_mask) for the configured backend)
+    """
+    global _text_encoder
+    if _text_encoder is None:
+        with _model_lock:
+            if _text_encoder is None:
+                from transformers import CLIPTokenizerFast, CLIPTextModelWithProjection
+                from clip_backends import build_text_encoder
+                tokenizer = CLIPTokenizerFast.from_pretrained(model_name)
+                text_model = CLIPTextModelWithProjection.from_pretrained(model_name)
+                text_model.eval()
+                _text_encoder = (tokenizer, build_text_encoder(text_model, backend, model_name))
+    return _text_encoder
+
+
+def get_image_encoder():
+    """
+    Load the CLIP image processor and vision tower once, thread-safely.
+
+    Returns:
+        tuple: (CLIPImageProcessor, encode(pixel_values) for the configured backend)
+    """
+    global _image_encoder
+    if _image_encoder is None:
+        with _model_lock:
+            if _image_encoder is None:
+                from transformers import CLIPImageProcessor, CLIPVisionModelWithProjection
+                from clip_backends import build_image_encoder
+                image_processor = CLIPImageProcessor.from_pretrained(model_name)
+                vision_model = CLIPVisionModelWithProjection.from_pretrained(model_name)
+                vision_model.eval()
+                _image_encoder = (image_processor, build_image_encoder(vision_model, backend, model_name))
+    return _image_encoder
+
+
+def warm_up(text=True, image=False):
+    """
+    Load the encoders and run one forward pass so the first real request is not slowed down.
+
+    Args:
+        text (bool): Warm up the text encoder
+        image (bool): Warm up the image encoder
+    """
+    if text:
+        create_text_embeddings(["warm up"])
+    if image:
+        import torch
+        image_processor, encode_images = get_image_encoder()
+        size = image_processor.crop_size['height']
+        with torch.no_grad():
+            encode_images(_pixel_values([np.zeros((size, size, 3), dtype=np.uint8)], image_processor))
+
+
+def _batches(items, batch_size):
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def _load_image(image_path):
+    return Image.open(image_path).convert('RGB')
+
+
+def _load_image_fast(image_path, size=224):
+    """
+    Decode an image straight to a center-cropped size x size uint8 array.
+
+    JPEG draft mode lets libjpeg scale the DCT by 1/2, 1/4 or 1/8 while
+    decoding, to the smallest scale still at least twice the target size;
+    the bicubic resize of the shortest edge and the center crop then match
+    CLIPImageProcessor.
+    """
+    image = Image.open(image_path)
+    image.draft('RGB', (2 * size, 2 * size))
+    image = image.convert('RGB')
+
+    width, height = image.size
+    scale = size / min(width, height)
+    resized = (max(size, int(width * scale)), max(size, int(height * scale)))
+    image = image.resize(resized, Image.BICUBIC)
+
+    left, top = (resized[0] - size) // 2, (resized[1] - size) // 2
+    return np.asarray(image.crop((left, top, left + size, top + size)), dtype=np.uint8)
+
+
+def _pixel_values(images, image_processor):
+    """Rescale and normalize a batch of HxWx3 uint8 arrays into a (N, 3, H, W) float32 tensor"""
+    import torch
+    mean = np.asarray(image_processor.image_mean, dtype=np.float32) * 255
+    inv_std = 1 / (np.asarray(image_processor.image_std, dtype=np.float32) * 255)
+    batch = (np.stack(images).astype(np.float32) - mean) * inv_std
+    return torch.from_numpy(np.ascontiguousarray(batch.transpose(0, 3, 1, 2)))
+
+
+def _prefetch_image_batches(image_paths, batch_size, prefetch_batches, num_workers, load=_load_image):
+    """
+    Decode image batches in a thread pool ahead of the model, like a DataLoader.
+
+    Args:
+        image_paths (list): Paths of the images to decode
+        batch_size (int): Number of images per batch
+        prefetch_batches (int): Number of decoded batches kept in flight
+        num_workers (int): Number of decoding threads
+        load (callable): Decodes one image path
+
+    Yields:
+        list: Decoded images for one batch, in input order
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        pending = deque()
+        for batch in _batches(image_paths, batch_size):
+            pending.append([pool.submit(load, path) for path in batch])
+            if len(pending) > prefetch_batches:
+                yield [future.result() for future in pending.popleft()]
+        while pending:
+            yield [future.result() for future in pending.popleft()]
+
+
+def _with_store(keys, compute, store):
+    """Serve embeddings from the store and run compute only on the missing positions"""
+    embeddings, missing = store.get_many(keys)
+    if missing:
+        computed = compute(missing)
+        embeddings[missing] = computed
+        store.put_many([keys[i] for i in missing], computed)
+    return embeddings
+
+
+def create_image_embeddings(image_paths, batch_size=DEFAULT_BATCH_SIZE,
+                            prefetch_batches=DEFAULT_PREFETCH_BATCHES, num_workers=DEFAULT_DECODE_WORKERS,
+                            store=None):
+    """
+    Create CLIP image embeddings for a list of images.
+
+    Args:
+        image_paths (list): Paths of the images to embed
+        batch_size (int): Number of images per forward pass
+        prefetch_batches (int): Number of decoded batches to prepare ahead of the model
+        num_workers (int): Number of threads decoding images
+        store (EmbeddingStore): Optional embedding store checked before running the model
+
+    Returns:
+        np.ndarray: (N, 512) float32 array, one row per image in input order
+    """
+    image_paths = list(image_paths)
+    if store is not None:
+        keys = [store.key(image_embedding_model_key(), hash_file(path)) for path in image_paths]
+        return _with_store(keys, lambda missing: create_image_embeddings(
+            [image_paths[i] for i in missing], batch_size, prefetch_batches, num_workers), store)
+
+    embeddings = np.empty((len(image_paths), EMBEDDING_DIM), dtype=np.float32)
+    if not image_paths:
+        return embeddings
+
+    import torch
+    image_processor, encode_images = get_image_encoder()
+    size = image_processor.crop_size['height']
+
+    if IMAGE_DECODE == "reference":
+        def load(path):
+            return _load_image(path)
+
+        def preprocess(images):
+            return image_processor(images=images, return_tensors="pt")["pixel_values"]
+    else:
+        def load(path):
+            return _load_image_fast(path, size)
+
+        def preprocess(images):
+            return _pixel_values(images, image_processor)
+
+    row = 0
+    for images in _prefetch_image_batches(image_paths, batch_size, prefetch_batches, num_workers, load=load):
+        with torch.no_grad():
+            outputs = encode_images(preprocess(images))
+        embeddings[row:row + len(images)] = outputs.numpy()
+        row += len(images)
+
+    return embeddings
+
+
+def create_text_embeddings(texts, batch_size=DEFAULT_BATCH_SIZE, store=None):
+    """
+    Create normalized CLIP text embeddings for a list of texts.
+
+    Texts are padded to TEXT_MAX_LENGTH, so a text gets the same embedding,
+    bit for bit, whatever batch it is part of (except with the int8 backend,
+    which quantizes activations per batch).
+
+    Args:
+        texts (list): Texts to embed
+        batch_size (int): Number of texts per forward pass
+        store (EmbeddingStore): Optional embedding store checked before running the model
+
+    Returns:
+        np.ndarray: (N, 512) float32 array, one row per text in input order
+    """
+    texts = list(texts)
+    if store is not None:
+        keys = [store.key(embedding_model_key(), hash_text(text)) for text in texts]
+        return _with_store(keys, lambda missing: create_text_embeddings(
+            [texts[i] for i in missing], batch_size), store)
+
+    embeddings = np.empty((len(texts), EMBEDDING_DIM), dtype=np.float32)
+    if not texts:
+        return embeddings
+
+    import torch
+    tokenizer, encode_texts = get_text_encoder()
+
+    for batch_indices in _batches(list(range(len(texts))), batch_size):
+        inputs = tokenizer([texts[i] for i in batch_indices], return_tensors="pt", truncation=True,
+                           padding="max_length", max_length=TEXT_MAX_LENGTH)
+        with torch.no_grad():
+            text_features = encode_texts(inputs["input_ids"], inputs["attention_mask"])
+            # Normalize the embedding (CLIP embeddings are typically normalized)
+            text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+        embeddings[batch_indices] = text_features.cpu().numpy()
+
+    return embeddings
 
 
 # Function to create embedding from an image
 def create_image_embedding(image_path):
-    image = Image.open(image_path).convert('RGB')
-    inputs = processor(images=image, return_tensors="pt", padding=True, truncation=True, use_fast=True)
-    with torch.no_grad():
-        outputs = model.get_image_features(**inputs)
-    return outputs.numpy().flatten()
+    return create_image_embeddings([image_path], batch_size=1)[0]
+
 
 def create_text_embedding(text):
+    if text_batcher is not None:
+        return text_batcher(text)
+    return create_text_embeddings([text], batch_size=1)[0]
 
-    # Process the text
-    inputs = processor(text=[text], return_tensors="pt", padding=True, truncation=True)
 
-    # Generate embedding
-    with torch.no_grad():
-        text_features = model.get_text_features(**inputs)
-        # Normalize the embedding (CLIP embeddings are typically normalized)
-        text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+def enable_text_batching(max_batch_size=32, max_wait_ms=5.0):
+    """
+    Route create_text_embedding through a MicroBatcher.
 
-    # Convert to numpy array
-    embedding = text_features.cpu().numpy().flatten()
+    Concurrent callers, e.g. the threads of the query service, then share
+    forward passes instead of each running a batch of one.
 
-    return embedding
+    Args:
+        max_batch_size (int): Largest batch sent to the text encoder
+        max_wait_ms (float): Longest a request waits for others to join its batch
 
+    Returns:
+        MicroBatcher: The installed batcher
+    """
+    global text_batcher
+    with _model_lock:
+        if text_batcher is None:
+            text_batcher = MicroBatcher(lambda texts: create_text_embeddings(texts, batch_size=max_batch_size),
+                                        max_batch_size=max_batch_size, max_wait_ms=max_wait_ms,
+                                        name="text-embedding-batcher")
+    return text_batcher
 
-def add_embeddings(json_file):
-    with open('images_metadata/' + json_file, 'r') as file:
-        data = json.load(file)
 
-        text = data['generated_description']
-        image_file = data['image_filename']
+def cached_text_embedding(text):
+    """
+    Create a normalized text embedding, reusing cached vectors for repeated texts.
+
+    Args:
+        text (str): Text to embed
+
+    Returns:
+        np.ndarray: Read-only (512,) float32 embedding
+    """
+    embedding = text_embedding_cache.get(text)
+    if embedding is None:
+        embedding = create_text_embedding(text)
+        embedding.flags.writeable = False
+        text_embedding_cache.put(text, embedding)
+    return embedding
+
 
-        file.close()
+def _load_metadata(json_file):
+    with open('images_metadata/' + json_file, 'r') as file:
+        return json.load(file)
 
-    text_embedding = create_text_embedding(text)
-    image_embedding = create_image_embedding('images_metadata/'+image_file)
 
+def _prune_metadata(data, text_embedding, image_embedding):
     data['text_embedding'] = text_embedding.tolist()
     data['image_embedding'] = image_embedding.tolist()
 
+    # Precompute which park boundaries contain the photo
+    data['park_id'] = load_park_shapes().parks_containing(data['geolocation']['lat'], data['geolocation']['lon'])
+
     # prune fields on the metadata
 
     allowed_keys = ["photo_id", "title", "description", "geolocation", "image_filename",
-                    "generated_description", "text_embedding", "image_embedding"]
-    pruned_data = {key: data[key] for key in allowed_keys}
+                    "generated_description", "park_id", "text_embedding", "image_embedding"]
+    return {key: data[key] for key in allowed_keys}
+
+
+def add_embeddings(json_file):
+    return add_embeddings_batch([json_file])[0]
+
+
+def add_embeddings_batch(json_files, batch_size=DEFAULT_BATCH_SIZE, store=None):
+    """
+    Load metadata files and add text and image embeddings in batches.
+
+    Args:
+        json_files (list): Metadata file names inside images_metadata/
+        batch_size (int): Number of items per forward pass
+        store (EmbeddingStore): Optional embedding store checked before running the model
+
+    Returns:
+        list: Pruned documents with text_embedding and image_embedding, in input order
+    """
+    metadata = [_load_metadata(json_file) for json_file in json_files]
 
-    return pruned_data
+    text_embeddings = create_text_embeddings([data['generated_description'] for data in metadata],
+                                             batch_size=batch_size, store=store)
+    image_embeddings = create_image_embeddings(['images_metadata/' + data['image_filename'] for data in metadata],
+                                               batch_size=batch_size, store=store)
 
+    return [_prune_metadata(data, text_embedding, image_embedding)
+            for data, text_embedding, image_embedding in zip(metadata, text_embeddings, image_embeddings)]
@@ -0,0 +1,145 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    """Raised when a request cannot be admitted within its queue and wait limits"""
+
+
+class MicroBatcher:
+    """
+    Collect concurrent single-item calls into batches for one worker thread.
+
+    The first queued item opens a batch; the batch is run when it reaches
+    max_batch_size items or max_wait_ms after that first item, whichever
+    comes first, so a lone request waits at most max_wait_ms.
+    """
+
+    def __init__(self, batch_fn, max_batch_size=32, max_wait_ms=5.0, max_queue=1024, name="micro-batcher"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_s = max_wait_ms / 1000
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """
+        Queue one item.
+
+        Returns:
+            Future: Resolves to batch_fn's result for this item
+
+        Raises:
+            Overloaded: When the queue is full
+        """
+        future = Future()
+        try:
+            self._queue.put_nowait((item, future))
+        except queue.Full:
+            raise Overloaded("micro-batch queue is full")
+        return future
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait_s
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.batch_fn(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize()
+        }
+
+
+class AdmissionController:
+    """
+    Bound the number of concurrent and waiting calls to a slow backend.
+
+    At most max_concurrent callers hold a slot; up to max_queue more wait for
+    one, for at most timeout_s. Anyone beyond that is rejected immediately
+    with Overloaded instead of piling up behind the backend.
+    """
+
+    def __init__(self, max_concurrent=2, max_queue=8, timeout_s=30.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout_s = timeout_s
+        self.admitted = 0
+        self.rejected = 0
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self):
+        with self._lock:
+            if self.waiting >= self.max_queue and self.active >= self.max_concurrent:
+                self.rejected += 1
+                raise Overloaded("too many requests waiting for the LLM")
+            self.waiting += 1
+
+        acquired = self._semaphore.acquire(timeout=self.timeout_s)
+        with self._lock:
+            self.waiting -= 1
+            if not acquired:
+                self.rejected += 1
+            else:
+                self.admitted += 1
+                self.active += 1
+        if not acquired:
+            raise Overloaded(f"no LLM slot freed up within {self.timeout_s:g}s")
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {"max_concurrent": self.max_concurrent, "max_queue": self.max_queue, "active": self.active,
+                "waiting": self.waiting, "admitted": self.admitted, "rejected": self.rejected}
+
+
+class Unbounded:
+    """AdmissionController stand-in that admits every call"""
+
+    @contextmanager
+    def slot(self):
+        yield
+
+    def stats(self):
+        return {}
@@ -0,0 +1,170 @@
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# Static instructions sent ahead of every query-specific part of the prompt.
+# Keeping them identical and first lets Ollama reuse their KV cache entries.
+RESPONSE_INSTRUCTIONS = """You are a helpful assistant for national parks activities. Based on the search results in the user message, provide a comprehensive and helpful response to the user's original query.
+
+Instructions:
+- Provide a natural, conversational response
+- Recommend specific activities and locations based on the search results only
+- Include practical information when available
+- Do not suggest alternatives if no results were found
+- Be enthusiastic and helpful about national parks experiences
+- Keep the response focused and not too lengthy
+- Structure your response separating your suggestions per national park
+- Do not include anything about national parks that are not in the results"""
+
+# Embedding returned with each search hit for near-duplicate pruning; empty disables it
+RESULT_EMBEDDING_FIELD = os.getenv('RESULT_EMBEDDING_FIELD', 'image_embedding')
+PROMPT_TOKEN_BUDGET = int(os.getenv('PROMPT_TOKEN_BUDGET', 1200))
+DUPLICATE_THRESHOLD = float(os.getenv('DUPLICATE_THRESHOLD', 0.92))
+SNIPPET_CHARS = 200
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count for English text (about four characters per token)"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _snippet(text: str, max_chars: int = SNIPPET_CHARS) -> str:
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(' ', 1)[0] + "..."
+
+
+def _word_set(text: str):
+    return set(re.findall(r"\w+", text.lower()))
+
+
+def _similarity_matrix(results: List[Dict[str, Any]], embedding_field: Optional[str]) -> np.ndarray:
+    if embedding_field and all(result.get(embedding_field) is not None for result in results):
+        vectors = np.array([result[embedding_field] for result in results], dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors @ vectors.T
+
+    # Without stored embeddings fall back to word overlap of the descriptions
+    words = [_word_set(result['generated_description']) for result in results]
+    similarities = np.eye(len(results), dtype=np.float32)
+    for i in range(len(results)):
+        for j in range(i + 1, len(results)):
+            union = len(words[i] | words[j])
+            similarities[i, j] = similarities[j, i] = len(words[i] & words[j]) / union if union else 0.0
+    return similarities
+
+
+def prune_near_duplicates(results: List[Dict[str, Any]], threshold: float = DUPLICATE_THRESHOLD,
+                          embedding_field: Optional[str] = RESULT_EMBEDDING_FIELD) -> List[Dict[str, Any]]:
+    """
+    Drop results that are near-duplicates of a higher ranked result.
+
+    Results are visited in relevance order and kept only while their maximum
+    similarity to the results already kept stays below the threshold, the
+    redundancy half of maximal marginal relevance.
+
+    Args:
+        results (list): Search results, best first within each park
+        threshold (float): Cosine similarity at which a result counts as a duplicate
+        embedding_field (str): Result field holding the embedding to compare
+
+    Returns:
+        list: The kept results, in their original order
+    """
+    if len(results) < 2:
+        return list(results)
+
+    order = sorted(range(len(results)), key=lambda i: -(results[i].get('_score') or 0.0))
+    similarities = _similarity_matrix(results, embedding_field)
+    kept = []
+    for i in order:
+        if not kept or similarities[i, kept].max() < threshold:
+            kept.append(i)
+    return [results[i] for i in sorted(kept)]
+
+
+def group_by_park(results: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Results per park, parks in order of first appearance and results best first"""
+    parks = {}
+    for result in results:
+        parks.setdefault(result['park_id'], []).append(result)
+    for park_results in parks.values():
+        park_results.sort(key=lambda result: -(result.get('_score') or 0.0))
+    return parks
+
+
+def naive_context(results: List[Dict[str, Any]]) -> str:
+    """The unpruned result listing with every snippet, filename and score"""
+    if not results:
+        return "No results found for your query."
+    text = "Search Results:\n"
+    for result in results:
+        text += f"   Title: {result['image_filename']}\n"
+        text += f"   Content: {result['generated_description'][:SNIPPET_CHARS]}...\n"
+        text += f"   Relevance Score: {result['_score']}\n"
+    return text
+
+
+def build_context(results: List[Dict[str, Any]], token_budget: int = PROMPT_TOKEN_BUDGET,
+                  threshold: float = DUPLICATE_THRESHOLD,
+                  embedding_field: Optional[str] = RESULT_EMBEDDING_FIELD) -> Tuple[str, Dict[str, Any]]:
+    """
+    Assemble the search results part of the answer prompt.
+
+    Near-duplicates are pruned, the rest is grouped under one heading per
+    park and results are added round-robin across parks, best first, until
+    the token budget is reached, so every park keeps its top result.
+
+    Args:
+        results (list): Search results tagged with park_id
+        token_budget (int): Estimated token cap for the results text
+        threshold (float): Near-duplicate similarity threshold
+        embedding_field (str): Result field holding the embedding to compare
+
+    Returns:
+        tuple: (results text, stats with result counts, estimated tokens
+        before and after, and build time in ms)
+    """
+    start = time.perf_counter()
+    stats = {"results": len(results), "tokens_before": estimate_tokens(naive_context(results))}
+    if not results:
+        text = "No results found for your query."
+        stats.update(results_after_dedup=0, results_used=0, tokens_after=estimate_tokens(text),
+                     build_ms=1000 * (time.perf_counter() - start))
+        return text, stats
+
+    unique = prune_near_duplicates(results, threshold, embedding_field)
+    parks = group_by_park(unique)
+
+    lines = {park_id: [] for park_id in parks}
+    used_tokens = estimate_tokens("Search Results:\n")
+    for park_id, park_results in parks.items():
+        state = park_results[0].get('park_state')
+        header = f"\n{park_id.replace('_', ' ').title()}{f' ({state})' if state else ''}:\n"
+        used_tokens += estimate_tokens(header)
+        lines[park_id].append(header)
+
+    used = 0
+    for rank in range(max(len(park_results) for park_results in parks.values())):
+        for park_id, park_results in parks.items():
+            if rank >= len(park_results):
+                continue
+            result = park_results[rank]
+            line = f"- {result['image_filename']}: {_snippet(result['generated_description'])}\n"
+            tokens = estimate_tokens(line)
+            # The first result of each park is always kept
+            if rank > 0 and used_tokens + tokens > token_budget:
+                continue
+            lines[park_id].append(line)
+            used_tokens += tokens
+            used += 1
+
+    text = "Search Results:\n" + "".join("".join(park_lines) for park_lines in lines.values())
+    stats.update(results_after_dedup=len(unique), results_used=used, tokens_after=estimate_tokens(text),
+                 build_ms=1000 * (time.perf_counter() - start))
+    return text, stats
@@ -0,0 +1,217 @@
+"""
+Pack the metadata corpus and its embeddings into one memory-mappable columnar file.
+
+    python corpus_pack.py [--output corpus.pack]
+
+Layout: an 8-byte magic, a little-endian uint64 header length, a JSON
+header, then every column as a raw little-endian array starting on a
+64-byte boundary. Fixed-width columns (coordinates, embedding matrices)
+are stored as-is; each string column is a uint8 array of concatenated
+UTF-8 bytes plus an int64 offsets array of length N + 1. Readers map the
+file once and slice rows or chunks out of the columns without parsing
+anything but the header.
+"""
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+
+from clip_processor import EMBEDDING_DIM
+from index_manifest import DOCUMENT_VERSION
+
+
+CORPUS_PACK_PATH = os.getenv('CORPUS_PACK', 'corpus.pack')
+MAGIC = b"PARKPACK"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+
+DOCUMENT_FIELDS = ("photo_id", "title", "description", "image_filename", "generated_description")
+HASH_FIELDS = ("image_hash", "text_hash")
+EMBEDDING_FIELDS = ("text_embedding", "image_embedding")
+
+
+def _aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _string_column(values):
+    encoded = [value.encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype='<i8')
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def write_corpus_pack(path, documents, model_key, fingerprints):
+    """
+    Write pruned documents and their embeddings as a corpus pack.
+
+    Args:
+        path (str): Output file
+        documents (list): Pruned documents with text_embedding and image_embedding
+        model_key (str): clip_processor.image_embedding_model_key() of the embeddings
+        fingerprints (dict): index_manifest fingerprint per photo_id
+    """
+    columns = {
+        "lat": np.array([doc['geolocation']['lat'] for doc in documents], dtype='<f8'),
+        "lon": np.array([doc['geolocation']['lon'] for doc in documents], dtype='<f8')
+    }
+
+    string_values = {field: [doc.get(field) or '' for doc in documents] for field in DOCUMENT_FIELDS}
+    string_values.update({field: [fingerprints[doc['photo_id']][field] for doc in documents] for field in HASH_FIELDS})
+    # Parks are joined with commas, park ids never contain one
+    string_values['park_id'] = [",".join(doc.get('park_id') or []) for doc in documents]
+    for field, values in string_values.items():
+        columns[f"{field}.data"], columns[f"{field}.offsets"] = _string_column(values)
+    for field in EMBEDDING_FIELDS:
+        columns[field] = np.array([doc[field] for doc in documents], dtype='<f4').reshape(len(documents), EMBEDDING_DIM)
+
+    header = {"format_version": FORMAT_VERSION, "document_version": DOCUMENT_VERSION, "model": model_key,
+              "count": len(documents), "columns": {}}
+    # The column offsets depend on the header length and the other way round: grow the reserved
+    # header space until the header fits, then pad it with spaces
+    header_length = 0
+    while True:
+        offset = _aligned(len(MAGIC) + 8 + header_length)
+        for name, array in columns.items():
+            header["columns"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset = _aligned(offset + array.nbytes)
+        header_bytes = json.dumps(header).encode()
+        if len(header_bytes) <= header_length:
+            break
+        header_length = len(header_bytes)
+    header_bytes = header_bytes.ljust(header_length)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        file.write(MAGIC + struct.pack('<Q', len(header_bytes)) + header_bytes)
+        for name, array in columns.items():
+            file.write(b"\0" * (header["columns"][name]["offset"] - file.tell()))
+            file.write(np.ascontiguousarray(array).tobytes())
+    os.replace(tmp_path, path)
+
+
+class CorpusPack:
+    """
+    Read-only, memory-mapped view of a corpus pack.
+
+    Columns are numpy views into the mapping, so opening the pack costs one
+    header read and rows are paged in only when touched.
+    """
+
+    def __init__(self, path=CORPUS_PACK_PATH):
+        self.path = path
+        with open(path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a corpus pack")
+            header_length, = struct.unpack('<Q', file.read(8))
+            self.header = json.loads(file.read(header_length))
+        if self.header["format_version"] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported corpus pack version {self.header['format_version']}")
+
+        self.model = self.header["model"]
+        self._buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        self._columns = {}
+
+    def __len__(self):
+        return self.header["count"]
+
+    def column(self, name):
+        """A column as a numpy view of the file"""
+        if name not in self._columns:
+            spec = self.header["columns"][name]
+            self._columns[name] = np.ndarray(tuple(spec["shape"]), dtype=np.dtype(spec["dtype"]),
+                                             buffer=self._buffer, offset=spec["offset"])
+        return self._columns[name]
+
+    def strings(self, field, start=0, stop=None):
+        """Decoded values of a string column for rows start:stop"""
+        stop = len(self) if stop is None else min(stop, len(self))
+        data, offsets = self.column(f"{field}.data"), self.column(f"{field}.offsets")
+        raw = data[offsets[start]:offsets[stop]].tobytes()
+        base = offsets[start]
+        return [raw[offsets[i] - base:offsets[i + 1] - base].decode('utf-8') for i in range(start, stop)]
+
+    def park_ids(self, start=0, stop=None):
+        return [value.split(",") if value else [] for value in self.strings("park_id", start, stop)]
+
+    def documents(self, start=0, stop=None, as_lists=False):
+        """
+        Rebuild pruned documents for rows start:stop.
+
+        Args:
+            start (int): First row
+            stop (int): Row after the last one, the end of the pack if None
+            as_lists (bool): Embeddings as float lists (JSON serializable) instead of array views
+
+        Returns:
+            list: Documents in the clip_processor._prune_metadata format
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        fields = {field: self.strings(field, start, stop) for field in DOCUMENT_FIELDS}
+        lats, lons = self.column("lat")[start:stop], self.column("lon")[start:stop]
+        embeddings = {field: self.column(field)[start:stop] for field in EMBEDDING_FIELDS}
+        park_ids = self.park_ids(start, stop)
+
+        documents = []
+        for row in range(stop - start):
+            doc = {field: values[row] for field, values in fields.items()}
+            doc['geolocation'] = {"lat": float(lats[row]), "lon": float(lons[row])}
+            doc['park_id'] = park_ids[row]
+            for field, matrix in embeddings.items():
+                doc[field] = matrix[row].tolist() if as_lists else matrix[row]
+            documents.append(doc)
+        return documents
+
+    def iter_documents(self, chunk_size=1000, as_lists=False):
+        """Yield the documents in chunks of at most chunk_size rows, reading the file sequentially"""
+        for start in range(0, len(self), chunk_size):
+            yield self.documents(start, start + chunk_size, as_lists=as_lists)
+
+    def fingerprints(self):
+        """index_manifest fingerprint per photo_id, without touching the metadata or image files"""
+        return {photo_id: {"image_hash": image_hash, "text_hash": text_hash, "model": self.model,
+                           "version": self.header["document_version"]}
+                for photo_id, image_hash, text_hash in zip(self.strings("photo_id"), self.strings("image_hash"),
+                                                           self.strings("text_hash"))}
+
+
+def pack_metadata(metadata_dir='images_metadata/', path=CORPUS_PACK_PATH, store=None):
+    """
+    Embed every metadata file (through the embedding store) and write the corpus pack.
+
+    Returns:
+        int: Number of documents packed
+    """
+    from clip_processor import add_embeddings_batch, image_embedding_model_key
+    from index_manifest import document_fingerprint
+
+    json_files = sorted(file for file in os.listdir(metadata_dir) if file.endswith('.json'))
+    documents = add_embeddings_batch(json_files, store=store)
+
+    fingerprints = {}
+    for json_file in json_files:
+        with open(os.path.join(metadata_dir, json_file), 'r') as file:
+            data = json.load(file)
+        fingerprints[data['photo_id']] = document_fingerprint(data, image_embedding_model_key(), metadata_dir)
+
+    write_corpus_pack(path, documents, image_embedding_model_key(), fingerprints)
+    return len(documents)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pack the metadata corpus into one columnar file")
+    parser.add_argument("--metadata-dir", default='images_metadata/')
+    parser.add_argument("--output", default=CORPUS_PACK_PATH)
+    args = parser.parse_args()
+
+    from embedding_store import EmbeddingStore
+
+    count = pack_metadata(args.metadata_dir, args.output,
+                          store=EmbeddingStore(os.getenv('EMBEDDING_STORE', 'embedding_store')))
+    print(f"Packed {count} documents into {args.output} ({os.path.getsize(args.output) / 1024 / 1024:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import json
+import os
+import threading
+import numpy as np
+
+
+class EmbeddingStore:
+    """
+    On-disk embedding cache keyed by (model name, content hash).
+
+    Vectors are appended as rows of a fixed-width float32 matrix in
+    vectors.f32 and located through keys.log, an append-only log with one
+    key per line whose line number is the key's row. Reads go through a
+    read-only memory map, so several worker processes can open the same
+    store with readonly=True and share the page cache.
+    """
+
+    def __init__(self, path, dim=512, readonly=False):
+        self.path = path
+        self.dim = dim
+        self.readonly = readonly
+        self._vectors_path = os.path.join(path, 'vectors.f32')
+        self._keys_path = os.path.join(path, 'keys.log')
+        self._lock = threading.Lock()
+        self._matrix = None
+
+        if not readonly:
+            os.makedirs(path, exist_ok=True)
+
+        self._rows = {}
+        self._keys_size = 0
+        if os.path.exists(self._keys_path):
+            self._load_keys()
+        elif os.path.exists(os.path.join(path, 'keys.json')):
+            self._load_legacy_keys()
+
+    def _vector_rows(self):
+        if not os.path.exists(self._vectors_path):
+            return 0
+        return os.path.getsize(self._vectors_path) // (self.dim * np.dtype(np.float32).itemsize)
+
+    def _load_keys(self):
+        # Only newline-terminated lines are complete; a crash mid-append can leave a partial
+        # last line, which is ignored here and cut off by the next put_many
+        with open(self._keys_path, 'rb') as file:
+            data = file.read()
+        # Keys past the end of vectors.f32 have no data behind them and are dropped the same way
+        lines = data.split(b'\n')[:-1][:self._vector_rows()]
+        self._keys_size = sum(len(line) + 1 for line in lines)
+        self._rows = {line.decode('utf-8'): row for row, line in enumerate(lines)}
+
+    def _load_legacy_keys(self):
+        # Stores written before keys.log kept the whole index in keys.json
+        with open(os.path.join(self.path, 'keys.json'), 'r') as file:
+            rows = json.load(file)
+        self._rows = {key: row for row, key in enumerate(sorted(rows, key=rows.get))}
+        if not self.readonly:
+            data = ''.join(f"{key}\n" for key in self._rows).encode('utf-8')
+            tmp_path = self._keys_path + '.tmp'
+            with open(tmp_path, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, self._keys_path)
+            self._keys_size = len(data)
+
+    @staticmethod
+    def key(model_name, content_hash):
+        return f"{model_name}:{content_hash}"
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def _mapped_matrix(self):
+        # Remap only when rows were appended since the last read
+        if self._matrix is None or len(self._matrix) < len(self._rows):
+            if not self._rows:
+                return np.empty((0, self.dim), dtype=np.float32)
+            self._matrix = np.memmap(self._vectors_path, dtype=np.float32, mode='r',
+                                     shape=(len(self._rows), self.dim))
+        return self._matrix
+
+    def get_many(self, keys):
+        """
+        Look up embeddings for a list of keys.
+
+        Args:
+            keys (list): Keys built with EmbeddingStore.key
+
+        Returns:
+            tuple: ((N, dim) float32 array with zero rows for misses, list of missing positions)
+        """
+        embeddings = np.zeros((len(keys), self.dim), dtype=np.float32)
+        missing = []
+        with self._lock:
+            matrix = self._mapped_matrix()
+            for position, key in enumerate(keys):
+                row = self._rows.get(key)
+                if row is None:
+                    missing.append(position)
+                else:
+                    embeddings[position] = matrix[row]
+        return embeddings, missing
+
+    def put_many(self, keys, embeddings):
+        """
+        Append embeddings for keys not yet in the store.
+
+        Args:
+            keys (list): Keys built with EmbeddingStore.key
+            embeddings (np.ndarray): (N, dim) array aligned with keys
+        """
+        if self.readonly:
+            raise PermissionError(f"Embedding store {self.path} is open read-only")
+
+        with self._lock:
+            # One row per distinct key: a key repeated within the call would otherwise get two
+            # rows in vectors.f32 but only one entry in the index, shifting every later row
+            new_rows = list({key: vector for key, vector in zip(keys, embeddings) if key not in self._rows}.items())
+            if not new_rows:
+                return
+
+            # Append the vectors before publishing their keys, so the index never points past the data.
+            # A crash between the two leaves orphan vectors at the end of the file; cut them off first so
+            # the new rows start right after the last indexed one
+            with open(self._vectors_path, 'ab') as file:
+                file.truncate(len(self._rows) * self.dim * np.dtype(np.float32).itemsize)
+                file.write(np.asarray([vector for _, vector in new_rows], dtype=np.float32).tobytes())
+
+            # Only the new keys are appended, so indexing a corpus costs I/O linear in its size
+            data = ''.join(f"{key}\n" for key, _ in new_rows).encode('utf-8')
+            with open(self._keys_path, 'ab') as file:
+                file.truncate(self._keys_size)
+                file.write(data)
+            self._keys_size += len(data)
+
+            for key, _ in new_rows:
+                self._rows[key] = len(self._rows)
@@ -0,0 +1,56 @@
+from elasticsearch import Elasticsearch
+import os
+import threading
+
+
+# Connection pool and retry defaults
+CONNECTIONS_PER_NODE = int(os.getenv('ES_CONNECTIONS_PER_NODE', 10))
+REQUEST_TIMEOUT = float(os.getenv('ES_REQUEST_TIMEOUT', 30))
+MAX_RETRIES = int(os.getenv('ES_MAX_RETRIES', 3))
+RETRY_ON_STATUS = (429, 502, 503, 504)
+
+_clients = {}
+_lock = threading.Lock()
+
+
+def get_es_client(host=None, api_key=None, connections_per_node=CONNECTIONS_PER_NODE,
+                  request_timeout=REQUEST_TIMEOUT, max_retries=MAX_RETRIES, retry_on_timeout=True,
+                  keep_alive=True, http_compress=False) -> Elasticsearch:
+    """
+    Get the process-wide Elasticsearch client for a host and API key.
+
+    Clients are created once and reused, so their pooled keep-alive
+    connections survive across searches, parks and Streamlit reruns.
+
+    Args:
+        host (str): Elasticsearch host, ES_HOST if not given
+        api_key (str): Elasticsearch API key, ES_API_KEY if not given
+        connections_per_node (int): Size of the connection pool per node
+        request_timeout (float): Request timeout in seconds
+        max_retries (int): Retries for failed requests
+        retry_on_timeout (bool): Retry requests that time out
+        keep_alive (bool): Keep pooled connections open between requests
+        http_compress (bool): Gzip request bodies
+
+    Returns:
+        Elasticsearch: Shared client
+    """
+    host = host or os.getenv('ES_HOST')
+    api_key = api_key or os.getenv('ES_API_KEY')
+    key = (host, api_key, connections_per_node, request_timeout, max_retries, retry_on_timeout, keep_alive,
+           http_compress)
+
+    with _lock:
+        if key not in _clients:
+            _clients[key] = Elasticsearch(
+                hosts=host,
+                api_key=api_key,
+                connections_per_node=connections_per_node,
+                request_timeout=request_timeout,
+                max_retries=max_retries,
+                retry_on_timeout=retry_on_timeout,
+                retry_on_status=RETRY_ON_STATUS,
+                http_compress=http_compress,
+                headers=None if keep_alive else {"Connection": "close"}
+            )
+        return _clients[key]
@@ -0,0 +1,348 @@
+"""
+Create, tune and rotate the Elasticsearch index of the photo documents.
+
+    python index_management.py create [--index-type int8_hnsw] [--m 16] [--ef-construction 100]
+    python index_management.py force-merge
+    python index_management.py reindex
+    python index_management.py sweep [--num-candidates 10 50 100 200 500] [--query-file queries.json]
+
+The index name comes from ES_INDEX. With reindex, ES_INDEX is an alias: a
+new versioned index is built and loaded behind it and the alias is swapped
+atomically once the load has finished, so searches never see a partial index.
+"""
+import argparse
+import json
+import os
+import time
+
+import random
+
+import numpy as np
+from elasticsearch import Elasticsearch
+
+from es_client import get_es_client
+
+
+EMBEDDING_DIMS = 512
+VECTOR_FIELDS = ("text_embedding", "image_embedding")
+# Retriever of build_retrievers searching each vector field
+KNN_RETRIEVERS = {"text_embedding": "text_knn", "image_embedding": "image_knn"}
+# int8_hnsw keeps a quarter of the float32 vector memory; bbq_hnsw (ES 8.18+) a thirty-second
+VECTOR_INDEX_TYPE = os.getenv('VECTOR_INDEX_TYPE', 'int8_hnsw')
+HNSW_M = int(os.getenv('HNSW_M', 16))
+HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', 100))
+FORCE_MERGE_TIMEOUT = 3600
+
+
+def build_index_body(index_type=VECTOR_INDEX_TYPE, m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION,
+                     dims=EMBEDDING_DIMS, number_of_shards=1, number_of_replicas=1):
+    """
+    Settings and explicit mappings for the photo documents.
+
+    Args:
+        index_type (str): dense_vector index type (hnsw, int8_hnsw, int4_hnsw, bbq_hnsw, flat, ...)
+        m (int): HNSW graph degree
+        ef_construction (int): HNSW candidate list size while building the graph
+        dims (int): Embedding dimensions
+        number_of_shards (int): Primary shards
+        number_of_replicas (int): Replicas per primary
+
+    Returns:
+        dict: Body for indices.create with "settings" and "mappings"
+    """
+    index_options = {"type": index_type}
+    if index_type.endswith("hnsw"):
+        index_options.update(m=m, ef_construction=ef_construction)
+
+    vector_mapping = {"type": "dense_vector", "dims": dims, "index": True, "similarity": "cosine",
+                      "index_options": index_options}
+
+    return {
+        "settings": {"number_of_shards": number_of_shards, "number_of_replicas": number_of_replicas},
+        "mappings": {
+            "dynamic": "strict",
+            "properties": {
+                "photo_id": {"type": "keyword"},
+                "title": {"type": "text"},
+                "description": {"type": "text"},
+                "generated_description": {"type": "text"},
+                "image_filename": {"type": "keyword", "index": False},
+                "geolocation": {"type": "geo_point"},
+                "park_id": {"type": "keyword"},
+                **{field: vector_mapping for field in VECTOR_FIELDS}
+            }
+        }
+    }
+
+
+def create_index(es: Elasticsearch, index_name, exist_ok=True, **options):
+    """
+    Create the index with the explicit mappings.
+
+    Args:
+        es (Elasticsearch): Elasticsearch client
+        index_name (str): Index to create
+        exist_ok (bool): Do nothing when the index or an alias of that name exists
+        **options: Passed to build_index_body
+
+    Returns:
+        bool: True when the index was created
+    """
+    if exist_ok and es.indices.exists(index=index_name):
+        return False
+    es.indices.create(index=index_name, **build_index_body(**options))
+    print(f"Created index {index_name} with {options.get('index_type', VECTOR_INDEX_TYPE)} vectors")
+    return True
+
+
+def force_merge(es: Elasticsearch, index_name, max_num_segments=1):
+    """
+    Merge the index segments after a bulk load.
+
+    Fewer segments means fewer HNSW graphs to search per kNN query. Only run
+    this on an index that is no longer being written to.
+    """
+    start = time.perf_counter()
+    es.options(request_timeout=FORCE_MERGE_TIMEOUT).indices.forcemerge(index=index_name,
+                                                                       max_num_segments=max_num_segments)
+    print(f"Force-merged {index_name} to {max_num_segments} segment(s) in {time.perf_counter() - start:.1f}s")
+
+
+def alias_targets(es: Elasticsearch, alias):
+    """Concrete indices the alias points to, empty when it does not exist"""
+    if not es.indices.exists_alias(name=alias):
+        return []
+    return sorted(es.indices.get_alias(name=alias).keys())
+
+
+def write_index(es: Elasticsearch, name):
+    """
+    Concrete index that writes to name end up in.
+
+    Settings and the index manifest belong to the concrete index, not to
+    the alias in front of it, so they are looked up by this name.
+
+    Returns:
+        str: name itself for a concrete index, else the alias's write index or its only index
+
+    Raises:
+        ValueError: When the alias points to several indices and none is its write index
+    """
+    if not es.indices.exists_alias(name=name):
+        return name
+    targets = es.indices.get_alias(name=name)
+    writable = [index for index, data in targets.items() if data["aliases"][name].get("is_write_index")]
+    if writable:
+        return writable[0]
+    if len(targets) == 1:
+        return next(iter(targets))
+    raise ValueError(f"Alias {name} points to {', '.join(sorted(targets))} and none is its write index")
+
+
+def swap_alias(es: Elasticsearch, alias, new_index, delete_old=False):
+    """
+    Point the alias at new_index in one atomic update_aliases call.
+
+    Args:
+        es (Elasticsearch): Elasticsearch client
+        alias (str): Alias searched by the application
+        new_index (str): Fully loaded index to serve from now on
+        delete_old (bool): Delete the indices the alias pointed to before
+
+    Returns:
+        list: The indices the alias pointed to before
+    """
+    old_indices = alias_targets(es, alias)
+    actions = [{"remove": {"index": index, "alias": alias}} for index in old_indices]
+    actions.append({"add": {"index": new_index, "alias": alias}})
+    es.indices.update_aliases(actions=actions)
+    print(f"Alias {alias} now points to {new_index} (was {', '.join(old_indices) or 'unset'})")
+
+    if delete_old:
+        for index in old_indices:
+            es.indices.delete(index=index)
+    return old_indices
+
+
+def reindex_with_alias(es: Elasticsearch, alias, load, delete_old=False, **options):
+    """
+    Rebuild the index behind an alias without downtime.
+
+    A new index named <alias>-<timestamp> is created with the current
+    mappings, filled by load(index_name), refreshed and force-merged, and only
+    then swapped in. A failed load leaves the alias on the old index.
+
+    Args:
+        es (Elasticsearch): Elasticsearch client
+        alias (str): Alias searched by the application
+        load (callable): Bulk loads every document into the given index name
+        delete_old (bool): Delete the previous indices after the swap
+        **options: Passed to build_index_body
+
+    Returns:
+        str: Name of the new index
+    """
+    if es.indices.exists(index=alias) and not es.indices.exists_alias(name=alias):
+        raise ValueError(f"{alias} is a concrete index; reindex it once into a new index and alias that instead")
+
+    new_index = f"{alias}-{time.strftime('%Y%m%d%H%M%S')}"
+    create_index(es, new_index, exist_ok=False, **options)
+    load(new_index)
+    es.indices.refresh(index=new_index)
+    force_merge(es, new_index)
+    swap_alias(es, alias, new_index, delete_old=delete_old)
+    return new_index
+
+
+def load_sweep_queries(count, query_file=None, geo_filter_mode="distance", seed=0):
+    """
+    Embed benchmark queries and build the retrievers production search sends for them.
+
+    Without query_file, every activity of the rule-based extractor is paired
+    with every park at the default search distance, as extract_rule_based
+    would parse "<activity> in <park>", and count pairs are sampled.
+
+    Args:
+        count (int): Maximum number of queries
+        query_file (str): JSON list of search parameters with "context_search", "park_id" and
+            optionally "distance_km"
+        geo_filter_mode (str): "distance" or "park", as in search_parks_elasticsearch
+        seed (int): Seed of the sampling
+
+    Returns:
+        list: Retrievers from build_retrievers, one dict per query
+    """
+    from clip_processor import cached_text_embedding
+    from LLM_conversation import national_parks
+    from park_shapes import load_park_shapes
+    from query_rules import ACTIVITIES, DEFAULT_DISTANCE_KM
+    from rag_search_execution import build_retrievers
+
+    if query_file:
+        with open(query_file, 'r') as file:
+            params = json.load(file)[:count]
+    else:
+        params = [{"context_search": activity, "park_id": park_id}
+                  for activity in ACTIVITIES for park_id in national_parks]
+        params = random.Random(seed).sample(params, min(count, len(params)))
+
+    shaped_parks = load_park_shapes().park_ids if geo_filter_mode == "park" else set()
+    queries = []
+    for param in params:
+        park_id = param["park_id"]
+        latitude, longitude = national_parks[park_id]['coordinates']
+        queries.append(build_retrievers(latitude, longitude, f"{param.get('distance_km', DEFAULT_DISTANCE_KM)}km",
+                                        param["context_search"],
+                                        query_vector=cached_text_embedding(param["context_search"]).tolist(),
+                                        park_id=park_id if park_id in shaped_parks else None))
+    return queries
+
+
+def exact_knn(es: Elasticsearch, index_name, field, query_vector, k, query_filter=None):
+    """Ground-truth top k by brute-force cosine similarity over the documents matching query_filter"""
+    response = es.search(index=index_name, size=k, source=False, query={
+        "script_score": {
+            "query": {"bool": {"filter": [query_filter]}} if query_filter else {"match_all": {}},
+            "script": {"source": f"cosineSimilarity(params.query_vector, '{field}') + 1.0",
+                       "params": {"query_vector": query_vector}}
+        }
+    })
+    return [hit["_id"] for hit in response["hits"]["hits"]]
+
+
+def num_candidates_sweep(es: Elasticsearch, index_name, queries, field="text_embedding", k=10,
+                         num_candidates_values=(10, 25, 50, 100, 200, 500), repeats=3):
+    """
+    Measure approximate kNN recall against exact kNN and latency per num_candidates.
+
+    Both searches apply the filter of the production kNN retriever of field.
+
+    Args:
+        es (Elasticsearch): Elasticsearch client
+        index_name (str): Index to query
+        queries (list): Retrievers from load_sweep_queries
+        field (str): Vector field to search
+        k (int): Neighbours per query
+        num_candidates_values (iterable): num_candidates settings to try (values below k are skipped)
+        repeats (int): Timed runs per query and setting
+
+    Returns:
+        list: One dict per setting with recall@k and took/wall latency percentiles in ms
+    """
+    knn_queries = [query[KNN_RETRIEVERS[field]]["knn"] for query in queries]
+    truth = [set(exact_knn(es, index_name, field, knn["query_vector"], k, query_filter=knn["filter"]))
+             for knn in knn_queries]
+
+    results = []
+    for num_candidates in num_candidates_values:
+        if num_candidates < k:
+            continue
+        recalls, took, wall = [], [], []
+        for knn, expected in zip(knn_queries, truth):
+            for _ in range(repeats):
+                start = time.perf_counter()
+                response = es.search(index=index_name, size=k, source=False,
+                                     knn={**knn, "k": k, "num_candidates": num_candidates})
+                wall.append(1000 * (time.perf_counter() - start))
+                took.append(response["took"])
+            found = {hit["_id"] for hit in response["hits"]["hits"]}
+            recalls.append(len(found & expected) / len(expected) if expected else 1.0)
+
+        results.append({
+            "num_candidates": num_candidates,
+            "recall_at_k": float(np.mean(recalls)),
+            "took_p50_ms": float(np.percentile(took, 50)),
+            "took_p95_ms": float(np.percentile(took, 95)),
+            "wall_p50_ms": float(np.percentile(wall, 50)),
+            "wall_p95_ms": float(np.percentile(wall, 95))
+        })
+        print(f"{field} num_candidates={num_candidates:<5} recall@{k}={results[-1]['recall_at_k']:.3f} "
+              f"took p50={results[-1]['took_p50_ms']:.1f} ms p95={results[-1]['took_p95_ms']:.1f} ms")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Elasticsearch index management")
+    parser.add_argument("command", choices=["create", "force-merge", "reindex", "sweep"])
+    parser.add_argument("--index", default=os.getenv('ES_INDEX'), help="Index or alias name (ES_INDEX)")
+    parser.add_argument("--index-type", default=VECTOR_INDEX_TYPE)
+    parser.add_argument("--m", type=int, default=HNSW_M)
+    parser.add_argument("--ef-construction", type=int, default=HNSW_EF_CONSTRUCTION)
+    parser.add_argument("--delete-old", action="store_true", help="Delete the previous index after reindex")
+    parser.add_argument("--field", nargs="+", default=list(VECTOR_FIELDS), choices=VECTOR_FIELDS)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=50, help="Benchmark queries for the sweep")
+    parser.add_argument("--query-file", help="JSON list of search parameters to sweep instead of sampled ones")
+    parser.add_argument("--geo-filter-mode", default=os.getenv('GEO_FILTER_MODE', 'distance'),
+                        choices=["distance", "park"])
+    parser.add_argument("--num-candidates", type=int, nargs="+", default=[10, 25, 50, 100, 200, 500])
+    parser.add_argument("--output", default=os.path.join("benchmark_results", "num_candidates_sweep.json"))
+    args = parser.parse_args()
+
+    es = get_es_client(os.getenv('ES_HOST'), os.getenv('ES_API_KEY'))
+    options = {"index_type": args.index_type, "m": args.m, "ef_construction": args.ef_construction}
+
+    if args.command == "create":
+        create_index(es, args.index, **options)
+    elif args.command == "force-merge":
+        force_merge(es, args.index)
+    elif args.command == "reindex":
+        from upload_documents import index_logic
+
+        reindex_with_alias(es, args.index, lambda index_name: index_logic(index=index_name, force_merge_after=False),
+                           delete_old=args.delete_old, **options)
+    else:
+        queries = load_sweep_queries(args.queries, query_file=args.query_file,
+                                     geo_filter_mode=args.geo_filter_mode)
+        results = {field: num_candidates_sweep(es, args.index, queries, field=field, k=args.k,
+                                                num_candidates_values=args.num_candidates)
+                   for field in args.field}
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, 'w') as file:
+            json.dump({"index": args.index, "k": args.k, "queries": len(queries),
+                       "geo_filter_mode": args.geo_filter_mode, "results": results}, file, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+
+
+# Bump when the indexed document fields change, so every document is re-sent
+DOCUMENT_VERSION = 2
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_text(text):
+    return hash_bytes(text.encode('utf-8'))
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def document_fingerprint(data, model_name, image_dir='images_metadata/'):
+    """
+    Build the content fingerprint of a metadata document.
+
+    Args:
+        data (dict): Parsed metadata document
+        model_name (str): Name of the embedding model
+        image_dir (str): Directory holding the image files
+
+    Returns:
+        dict: Hashes of the image bytes and generated_description plus the model name
+    """
+    return {
+        "image_hash": hash_file(os.path.join(image_dir, data['image_filename'])),
+        "text_hash": hash_text(data['generated_description']),
+        "model": model_name,
+        "version": DOCUMENT_VERSION
+    }
+
+
+class IndexManifest:
+    """
+    Record of the documents already indexed, keyed by photo_id.
+
+    The manifest is written atomically, so a run that is interrupted keeps
+    every document acknowledged before the last save and resumes from there.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.documents = {}
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                self.documents = json.load(file)
+        self._dirty = False
+
+    def is_current(self, photo_id, fingerprint):
+        return self.documents.get(photo_id) == fingerprint
+
+    def update(self, photo_id, fingerprint):
+        self.documents[photo_id] = fingerprint
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.documents, file)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
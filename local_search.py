@@ -0,0 +1,220 @@
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from clip_processor import EMBEDDING_DIM
+from rank_fusion import reciprocal_rank_fusion
+from context_builder import RESULT_EMBEDDING_FIELD
+
+
+EARTH_RADIUS_KM = 6371.0088
+_TOKEN_PATTERN = re.compile(r"\w+")
+_DISTANCE_PATTERN = re.compile(r"^\s*([\d.]+)\s*(km|m|mi|miles)?\s*$")
+_DISTANCE_UNITS_KM = {"km": 1.0, "m": 0.001, "mi": 1.609344, "miles": 1.609344, None: 0.001}
+
+
+def tokenize(text):
+    return _TOKEN_PATTERN.findall(text.lower()) if text else []
+
+
+def parse_distance_km(distance):
+    """
+    Convert an Elasticsearch distance ("100km", "50mi", 2000) to kilometers.
+
+    Plain numbers are meters, as in Elasticsearch.
+    """
+    if isinstance(distance, (int, float)):
+        return distance / 1000.0
+    match = _DISTANCE_PATTERN.match(str(distance))
+    if not match:
+        raise ValueError(f"Unsupported distance: {distance}")
+    return float(match.group(1)) * _DISTANCE_UNITS_KM[match.group(2)]
+
+
+def haversine_km(lat, lon, lats, lons):
+    """
+    Vectorized great-circle distance from one point to many.
+
+    Args:
+        lat (float): Latitude of the origin in degrees
+        lon (float): Longitude of the origin in degrees
+        lats (np.ndarray): Latitudes in degrees
+        lons (np.ndarray): Longitudes in degrees
+
+    Returns:
+        np.ndarray: Distances in kilometers
+    """
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+class BM25Index:
+    """
+    In-memory BM25 index over one text field, scored like Elasticsearch's default similarity.
+    """
+
+    def __init__(self, texts, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.num_docs = len(texts)
+        self.doc_lengths = np.zeros(self.num_docs, dtype=np.float32)
+        self.postings = defaultdict(list)
+
+        for doc, text in enumerate(texts):
+            tokens = tokenize(text)
+            self.doc_lengths[doc] = len(tokens)
+            for term, freq in Counter(tokens).items():
+                self.postings[term].append((doc, freq))
+
+        self.postings = {term: (np.array([doc for doc, _ in entries]),
+                                np.array([freq for _, freq in entries], dtype=np.float32))
+                         for term, entries in self.postings.items()}
+        self.avg_length = float(self.doc_lengths.mean()) if self.num_docs else 0.0
+
+    def score(self, query):
+        """
+        Score every document against a query.
+
+        Returns:
+            np.ndarray: BM25 score per document, 0 for documents without matching terms
+        """
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            docs, freqs = self.postings[term]
+            idf = math.log(1 + (self.num_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[docs] / self.avg_length)
+            scores[docs] += idf * freqs * (self.k1 + 1) / (freqs + norm)
+        return scores
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class LocalSearchEngine:
+    """
+    In-process replacement for the Elasticsearch RRF search.
+
+    Combines exact cosine kNN over text_embedding and image_embedding, BM25
+    over description and generated_description, and a haversine geo filter,
+    and fuses the three retrievers with RRF. rrf_search returns hits shaped
+    like the Elasticsearch ones.
+    """
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.ids = [doc['photo_id'] for doc in documents]
+        self.positions = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self.lats = np.array([doc['geolocation']['lat'] for doc in documents], dtype=np.float64)
+        self.lons = np.array([doc['geolocation']['lon'] for doc in documents], dtype=np.float64)
+        self.park_ids = [set(doc.get('park_id') or []) for doc in documents]
+        self.text_matrix = _normalize_rows(np.array([doc['text_embedding'] for doc in documents],
+                                                    dtype=np.float32).reshape(len(documents), EMBEDDING_DIM))
+        self.image_matrix = _normalize_rows(np.array([doc['image_embedding'] for doc in documents],
+                                                     dtype=np.float32).reshape(len(documents), EMBEDDING_DIM))
+        self.bm25_fields = [BM25Index([doc.get('description') or '' for doc in documents]),
+                            BM25Index([doc.get('generated_description') or '' for doc in documents])]
+
+    @classmethod
+    def from_metadata(cls, metadata_dir='images_metadata/', store=None):
+        """
+        Build the engine from the metadata files, embedding them with clip_processor.
+
+        Args:
+            metadata_dir (str): Directory with the *_metadata.json files and images
+            store (EmbeddingStore): Embedding store, so a warm store needs no CLIP inference
+
+        Returns:
+            LocalSearchEngine: Engine over every metadata document
+        """
+        from clip_processor import add_embeddings_batch
+
+        json_files = sorted(file for file in os.listdir(metadata_dir) if file.endswith('.json'))
+        return cls(add_embeddings_batch(json_files, store=store))
+
+    @classmethod
+    def from_corpus_pack(cls, path):
+        """Build the engine from a corpus pack in one sequential read, without CLIP"""
+        from corpus_pack import CorpusPack
+
+        return cls(CorpusPack(path).documents())
+
+    @classmethod
+    def from_documents_file(cls, path):
+        """Build the engine from a JSON list of already embedded documents"""
+        with open(path, 'r') as file:
+            return cls(json.load(file))
+
+    def geo_mask(self, lat, lon, distance, park_id=None):
+        if park_id is not None:
+            return np.array([park_id in parks for parks in self.park_ids], dtype=bool)
+        return haversine_km(lat, lon, self.lats, self.lons) <= parse_distance_km(distance)
+
+    def _knn(self, matrix, query_vector, candidates, k):
+        similarities = matrix[candidates] @ query_vector
+        top = np.argsort(-similarities, kind='stable')[:k]
+        return [self.ids[i] for i in candidates[top]]
+
+    def retrieve(self, lat, lon, distance, text_query, k=10, query_vector=None, park_id=None):
+        """
+        Run the three retrievers inside the geo filter.
+
+        Returns:
+            list: Ranked document ids from the standard, text kNN and image kNN retrievers
+        """
+        candidates = np.flatnonzero(self.geo_mask(lat, lon, distance, park_id=park_id))
+        if not len(candidates):
+            return [[], [], []]
+
+        # A bool query with a filter matches every filtered document; should clauses only rank them
+        bm25 = sum(field.score(text_query) for field in self.bm25_fields)[candidates]
+        standard = [self.ids[i] for i in candidates[np.argsort(-bm25, kind='stable')]]
+
+        if query_vector is None:
+            from clip_processor import cached_text_embedding
+            query_vector = cached_text_embedding(text_query)
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        query_vector = query_vector / (np.linalg.norm(query_vector) or 1.0)
+
+        return [standard,
+                self._knn(self.text_matrix, query_vector, candidates, k),
+                self._knn(self.image_matrix, query_vector, candidates, k)]
+
+    def rrf_search(self, lat, lon, distance, text_query, k=10, num_candidates=100, query_vector=None, size=3,
+                   rank_constant=60, rank_window_size=10, park_id=None):
+        """
+        Same contract as rag_search_execution.rrf_search, answered in process.
+
+        num_candidates is accepted for compatibility; the kNN here is exact.
+
+        Returns:
+            list: Hits with _id, _score and _source (image_filename, generated_description and
+            the RESULT_EMBEDDING_FIELD embedding)
+        """
+        fused = reciprocal_rank_fusion(self.retrieve(lat, lon, distance, text_query, k=k,
+                                                     query_vector=query_vector, park_id=park_id),
+                                       rank_constant=rank_constant, rank_window_size=rank_window_size)
+
+        hits = []
+        for doc_id, score in fused[:size]:
+            doc = self.documents[self.positions[doc_id]]
+            hits.append({
+                "_index": "local",
+                "_id": doc_id,
+                "_score": score,
+                "_source": {"image_filename": doc['image_filename'],
+                            "generated_description": doc['generated_description'],
+                            **({RESULT_EMBEDDING_FIELD: doc[RESULT_EMBEDDING_FIELD]}
+                               if RESULT_EMBEDDING_FIELD in doc else {})}
+            })
+        return hits
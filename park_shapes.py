@@ -0,0 +1,104 @@
+import json
+import math
+import os
+from collections import defaultdict
+from functools import lru_cache
+
+
+GEO_SHAPES_PATH = os.getenv('PARK_SHAPES', 'parks_geojson/geo_shapes.json')
+GRID_CELL_DEGREES = 1.0
+
+# geo_shapes.json names whose id differs from the national_parks keys
+PARK_ID_ALIASES = {
+    "mount_rainier_national_park": "mt_rainier_national_park"
+}
+
+
+def park_id_from_name(name):
+    park_id = name.lower().replace(' ', '_')
+    return PARK_ID_ALIASES.get(park_id, park_id)
+
+
+def _point_in_ring(lon, lat, ring):
+    # Ray casting: count crossings of a horizontal ray from the point
+    inside = False
+    j = len(ring) - 1
+    for i in range(len(ring)):
+        xi, yi = ring[i][0], ring[i][1]
+        xj, yj = ring[j][0], ring[j][1]
+        if (yi > lat) != (yj > lat) and lon < (xj - xi) * (lat - yi) / (yj - yi) + xi:
+            inside = not inside
+        j = i
+    return inside
+
+
+def _point_in_polygon(lon, lat, rings):
+    # The first ring is the outer boundary, the others are holes
+    return _point_in_ring(lon, lat, rings[0]) and not any(_point_in_ring(lon, lat, hole) for hole in rings[1:])
+
+
+def _cell(lon, lat):
+    return math.floor(lon / GRID_CELL_DEGREES), math.floor(lat / GRID_CELL_DEGREES)
+
+
+class ParkShapeIndex:
+    """
+    Park boundary polygons with a uniform grid index for point-in-polygon lookups.
+
+    Each polygon is registered in every grid cell its bounding box overlaps,
+    so a lookup only tests the polygons sharing the point's cell.
+    """
+
+    def __init__(self, features):
+        self.polygons = []
+        self.grid = defaultdict(list)
+
+        for feature in features:
+            geometry = feature['geometry']
+            park_id = park_id_from_name(feature['properties']['name'])
+            polygons = [geometry['coordinates']] if geometry['type'] == 'Polygon' else geometry['coordinates']
+
+            for rings in polygons:
+                lons = [point[0] for point in rings[0]]
+                lats = [point[1] for point in rings[0]]
+                bbox = (min(lons), min(lats), max(lons), max(lats))
+                position = len(self.polygons)
+                self.polygons.append((park_id, bbox, rings))
+
+                min_cell, max_cell = _cell(bbox[0], bbox[1]), _cell(bbox[2], bbox[3])
+                for x in range(min_cell[0], max_cell[0] + 1):
+                    for y in range(min_cell[1], max_cell[1] + 1):
+                        self.grid[(x, y)].append(position)
+
+        self.park_ids = {park_id for park_id, _, _ in self.polygons}
+
+    @classmethod
+    def from_geojson(cls, path):
+        with open(path, 'r') as file:
+            return cls(json.load(file)['features'])
+
+    def parks_containing(self, lat, lon):
+        """
+        Find the parks whose boundary contains a point.
+
+        Args:
+            lat (float): Latitude of the point
+            lon (float): Longitude of the point
+
+        Returns:
+            list: Sorted park ids, empty when the point is outside every park
+        """
+        parks = set()
+        for position in self.grid.get(_cell(lon, lat), []):
+            park_id, bbox, rings = self.polygons[position]
+            if park_id in parks or not (bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]):
+                continue
+            if _point_in_polygon(lon, lat, rings):
+                parks.add(park_id)
+        return sorted(parks)
+
+
+@lru_cache(maxsize=None)
+def load_park_shapes(path=GEO_SHAPES_PATH):
+    """Load the park polygons once per process and share them between indexing and search"""
+    return ParkShapeIndex.from_geojson(path)
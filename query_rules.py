@@ -0,0 +1,131 @@
+import re
+from typing import Any, Dict, Optional
+
+
+US_STATES = [
+    "Alabama", "Alaska", "Arizona", "Arkansas", "California", "Colorado", "Connecticut", "Delaware",
+    "Florida", "Georgia", "Hawaii", "Idaho", "Illinois", "Indiana", "Iowa", "Kansas", "Kentucky",
+    "Louisiana", "Maine", "Maryland", "Massachusetts", "Michigan", "Minnesota", "Mississippi", "Missouri",
+    "Montana", "Nebraska", "Nevada", "New Hampshire", "New Jersey", "New Mexico", "New York",
+    "North Carolina", "North Dakota", "Ohio", "Oklahoma", "Oregon", "Pennsylvania", "Rhode Island",
+    "South Carolina", "South Dakota", "Tennessee", "Texas", "Utah", "Vermont", "Virginia", "Washington",
+    "West Virginia", "Wisconsin", "Wyoming"
+]
+
+# Activity searched for -> words that signal it in a query
+ACTIVITIES = {
+    "hike": ["hike", "hikes", "hiking", "trail", "trails", "trek", "trekking"],
+    "camping": ["camp", "camping", "campsite", "campsites", "campground", "campgrounds"],
+    "walk dog": ["dog", "dogs", "dog friendly"],
+    "photography": ["photo", "photos", "photography", "photograph", "photographs"],
+    "wildlife": ["wildlife", "animals", "bear", "bears", "elk", "bison"],
+    "geyser": ["geyser", "geysers", "hot spring", "hot springs"],
+    "waterfall": ["waterfall", "waterfalls", "falls"],
+    "lake": ["lake", "lakes"],
+    "river": ["river", "rivers", "rafting", "kayak", "kayaking"],
+    "fishing": ["fish", "fishing"],
+    "sunset": ["sunset", "sunsets", "sunrise", "sunrises"],
+    "scenic view": ["view", "views", "viewpoint", "overlook", "overlooks", "scenic"]
+}
+
+DEFAULT_DISTANCE_KM = 100
+_KM_PER_UNIT = {"km": 1.0, "kilometer": 1.0, "kilometers": 1.0, "mi": 1.609344, "mile": 1.609344,
+                "miles": 1.609344}
+_DISTANCE_PATTERN = re.compile(r"\b(?:within|under|less than|up to)\s+(\d+(?:\.\d+)?)\s*"
+                               r"(km|kilometers?|mi|miles?)\b")
+# A location given relative to a city needs the LLM to resolve the city's state
+_REFERENCE_PATTERN = re.compile(r"\b(?:near|close to|around|from|outside)\s+(?!the\b)\w+")
+_PARK_SUFFIXES = (" national park", " national battlefield")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace"""
+    return " ".join(re.sub(r"[^\w\s.-]", " ", query.lower()).replace("-", " ").split())
+
+
+def _contains(text: str, phrase: str) -> bool:
+    return re.search(rf"\b{re.escape(phrase)}\b", text) is not None
+
+
+def _park_aliases(park_id: str):
+    name = park_id.replace('_', ' ')
+    for suffix in _PARK_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    aliases = {name}
+    if name.startswith("mt "):
+        aliases |= {"mount " + name[3:], name[3:]}
+    return aliases
+
+
+def extract_rule_based(query: str, parks: Dict[str, Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Extract search parameters with a gazetteer and a small activity vocabulary.
+
+    Args:
+        query (str): User query
+        parks (dict): Parks keyed by park id, each with a "state"
+
+    Returns:
+        dict: Search parameters in the LLM extractor format, or None when the
+        query is not covered confidently (no activity, no park or state with
+        parks, or a location relative to a city)
+    """
+    text = normalize_query(query)
+
+    if _REFERENCE_PATTERN.search(text):
+        return None
+
+    activities = [activity for activity, words in ACTIVITIES.items()
+                  if any(_contains(text, word) for word in words)]
+    if len(activities) != 1:
+        return None
+
+    relevant_parks = [park_id for park_id in parks
+                      if any(_contains(text, alias) for alias in _park_aliases(park_id))]
+    states = [state for state in US_STATES if _contains(text, state.lower())]
+    if not relevant_parks:
+        relevant_parks = [park_id for park_id, info in parks.items() if info['state'] in states]
+    if not relevant_parks:
+        return None
+
+    distance_km = DEFAULT_DISTANCE_KM
+    match = _DISTANCE_PATTERN.search(text)
+    if match:
+        distance_km = round(float(match.group(1)) * _KM_PER_UNIT[match.group(2)])
+
+    location_type = states[0] if states else parks[relevant_parks[0]]['state']
+
+    return {
+        "context_search": activities[0],
+        "distance_km": distance_km,
+        "location_type": location_type,
+        "reference_location": None,
+        "relevant_parks": relevant_parks
+    }
+
+
+def location_terms(query: str, parks: Dict[str, Dict[str, Any]]) -> frozenset:
+    """
+    Park and state names mentioned in a query.
+
+    Two queries that name different places need different answers even when
+    their embeddings are close, so this is used to partition cached answers.
+    """
+    text = normalize_query(query)
+    states = {state for state in US_STATES if _contains(text, state.lower())}
+    mentioned = {park_id for park_id in parks
+                 if any(_contains(text, alias) for alias in _park_aliases(park_id))}
+    return frozenset(states | mentioned)
+
+
+def activity_terms(query: str) -> frozenset:
+    """
+    Activities of the ACTIVITIES vocabulary mentioned in a query.
+
+    The names match the context_search the rule-based extractor returns, so
+    they can partition cached answers by activity before any extraction.
+    """
+    text = normalize_query(query)
+    return frozenset(activity for activity, words in ACTIVITIES.items()
+                     if any(_contains(text, word) for word in words))
@@ -0,0 +1,149 @@
+"""
+Long-lived HTTP query service around process_parks_query.
+
+One process holds the CLIP text encoder, the Elasticsearch connection pool
+and the answer caches for every client. Concurrent query embeddings are
+collected into micro-batches and Ollama calls pass through admission
+control, so a burst of users queues briefly or gets a 503 instead of
+oversubscribing the CPU. Run with:
+
+    python query_service.py
+
+and point the Streamlit app at it with QUERY_SERVICE_URL=http://localhost:8000.
+"""
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import Literal
+
+import uvicorn
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+
+import clip_processor
+import LLM_conversation as conversation
+from concurrency import AdmissionController, Overloaded
+from context_builder import RESULT_EMBEDDING_FIELD
+from es_client import get_es_client
+from tracing import Trace, metrics_registry
+
+
+TEXT_BATCH_SIZE = int(os.getenv('TEXT_BATCH_SIZE', 32))
+TEXT_BATCH_WAIT_MS = float(os.getenv('TEXT_BATCH_WAIT_MS', 5))
+RETRY_AFTER_SECONDS = 5
+
+
+class QueryRequest(BaseModel):
+    query: str
+    stream: bool = False
+    multi_park_mode: Literal["sequential", "msearch"] = "sequential"
+    fusion_mode: Literal["server", "client"] = conversation.FUSION_MODE
+    geo_filter_mode: Literal["distance", "park"] = conversation.GEO_FILTER_MODE
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    load_dotenv()
+    app.state.host = os.getenv('ES_HOST')
+    app.state.api_key = os.getenv('ES_API_KEY')
+    app.state.es_client = get_es_client(app.state.host, app.state.api_key)
+
+    app.state.text_batcher = clip_processor.enable_text_batching(TEXT_BATCH_SIZE, TEXT_BATCH_WAIT_MS)
+    if not isinstance(conversation.llm_admission, AdmissionController):
+        conversation.llm_admission = AdmissionController(
+            max_concurrent=int(os.getenv('LLM_MAX_CONCURRENCY', 2)),
+            max_queue=int(os.getenv('LLM_MAX_QUEUE', 8)),
+            timeout_s=float(os.getenv('LLM_QUEUE_TIMEOUT', 30)))
+    await run_in_threadpool(clip_processor.warm_up)
+    yield
+
+
+app = FastAPI(title="National Parks query service", lifespan=lifespan)
+
+
+def _public_results(search_results):
+    """Results without the embedding vectors, which only the prompt builder needs"""
+    return [{key: value for key, value in result.items() if key != RESULT_EMBEDDING_FIELD}
+            for result in search_results]
+
+
+def _overloaded(error):
+    return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+
+
+def _stream_lines(search_results, first_token, tokens, generation_stats, trace):
+    yield json.dumps({"results": _public_results(search_results)}) + "\n"
+    if first_token is not None:
+        yield json.dumps({"token": first_token}) + "\n"
+    try:
+        for token in tokens:
+            yield json.dumps({"token": token}) + "\n"
+    except Overloaded as e:
+        yield json.dumps({"error": str(e)}) + "\n"
+    yield json.dumps({"generation_stats": generation_stats, "trace": trace.to_dict()}) + "\n"
+
+
+@app.post("/query")
+async def query(request: QueryRequest):
+    """
+    Answer a query.
+
+    Without stream the body is {"response", "results", "generation_stats",
+    "trace"}. With stream it is NDJSON: one {"results"} line, one {"token"}
+    line per generated token and a final {"generation_stats", "trace"} line.
+    """
+    trace = Trace()
+    generation_stats = {}
+    try:
+        output = await run_in_threadpool(conversation.process_parks_query, request.query, app.state.host,
+                                         app.state.api_key, multi_park_mode=request.multi_park_mode,
+                                         es_client=app.state.es_client, stream=request.stream,
+                                         generation_stats=generation_stats, trace=trace,
+                                         fusion_mode=request.fusion_mode, geo_filter_mode=request.geo_filter_mode)
+    except Overloaded as e:
+        raise _overloaded(e)
+
+    # An unparseable query comes back as a bare message in non-streaming mode
+    response, search_results = output if isinstance(output, tuple) else (output, [])
+
+    if not request.stream:
+        return {"response": response, "results": _public_results(search_results),
+                "generation_stats": generation_stats, "trace": trace.to_dict()}
+
+    # Wait for the first token here, so a full LLM queue is still a 503 rather than a broken stream
+    try:
+        first_token = await run_in_threadpool(next, response, None)
+    except Overloaded as e:
+        raise _overloaded(e)
+
+    return StreamingResponse(_stream_lines(search_results, first_token, response, generation_stats, trace),
+                             media_type="application/x-ndjson")
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/stats")
+async def stats():
+    return {"text_batcher": app.state.text_batcher.stats(), "llm_admission": conversation.llm_admission.stats(),
+            "answer_cache": conversation.answer_cache.stats(), "extraction": conversation.extraction_report()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    lines = [metrics_registry.to_prometheus().rstrip("\n")]
+    for section, values in (("text_batcher", app.state.text_batcher.stats()),
+                            ("llm_admission", conversation.llm_admission.stats())):
+        for name, value in values.items():
+            lines.append(f"# TYPE {metrics_registry.prefix}_{section}_{name} gauge")
+            lines.append(f"{metrics_registry.prefix}_{section}_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=os.getenv('QUERY_SERVICE_HOST', '0.0.0.0'), port=int(os.getenv('QUERY_SERVICE_PORT', 8000)))
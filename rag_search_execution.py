@@ -1,35 +1,54 @@
-from elasticsearch_dsl import Search, Q
-from elasticsearch import Elasticsearch
-from clip_processor import create_text_embedding
+from elasticsearch_dsl import Search, MultiSearch, Q
+from clip_processor import cached_text_embedding
+from es_client import get_es_client
+from rank_fusion import reciprocal_rank_fusion
+from tracing import NULL_TRACE
+from context_builder import RESULT_EMBEDDING_FIELD
 import os
 
 
 index = os.getenv('ES_INDEX')
 
 
-def rrf_search(host, api_key, index_name, lat, lon, distance, text_query, k=10,
-               num_candidates=100):
+RETRIEVERS = ("standard", "text_knn", "image_knn")
+# kNN defaults, tune num_candidates with `python index_management.py sweep`
+KNN_K = int(os.getenv('KNN_K', 10))
+KNN_NUM_CANDIDATES = int(os.getenv('KNN_NUM_CANDIDATES', 100))
+SOURCE_FIELDS = ["image_filename", "generated_description"] + ([RESULT_EMBEDDING_FIELD] if RESULT_EMBEDDING_FIELD else [])
+
+
+def build_retrievers(lat, lon, distance, text_query, k=KNN_K, num_candidates=KNN_NUM_CANDIDATES, query_vector=None,
+                     park_id=None):
     """
-    Create an RRF search object bound to a specific index.
+    Build the three retrievers used by the RRF search.
+
+    With park_id the retrievers filter on the park_id keyword stored at index
+    time instead of computing a geo distance.
 
     Args:
-        index_name (str): Name of the Elasticsearch index
         lat (float): Latitude for geo filtering
         lon (float): Longitude for geo filtering
         distance (int/str): Distance for geo filtering
         text_query (str): Text to search in description fields
         k (int): Number of top results for KNN search
         num_candidates (int): Number of candidates for KNN search
+        query_vector (list): Precomputed embedding of text_query, computed here if not given
+        park_id (str): Park to filter on instead of the distance around lat/lon
 
     Returns:
-        Search: elasticsearch_dsl Search object ready to execute
+        dict: Retriever definitions keyed by name, in RETRIEVERS order
     """
 
-    embedding = create_text_embedding(text_query).tolist()
-    # Create geo distance query
-    geo_filter = Q('geo_distance',
-                   distance=distance,
-                   geolocation={'lat': lat, 'lon': lon})
+    if query_vector is None:
+        query_vector = cached_text_embedding(text_query).tolist()
+    embedding = query_vector
+    # Create geo distance query, or a cached term filter on the precomputed park membership
+    if park_id is not None:
+        geo_filter = Q('term', park_id=park_id)
+    else:
+        geo_filter = Q('geo_distance',
+                       distance=distance,
+                       geolocation={'lat': lat, 'lon': lon})
 
     # Create text search queries
     text_queries = [
@@ -40,20 +59,15 @@ def rrf_search(host, api_key, index_name, lat, lon, distance, text_query, k=10,
     # Create boolean query for standard search
     standard_query = Q('bool', filter=[geo_filter], should=text_queries)
 
-    # Create search object bound to index
-    s = Search(index=index_name)
-    s = s.source(["image_filename", "generated_description"])
-
-    # Build RRF configuration
-    retrievers = [
+    return {
         # Standard retriever
-        {
+        "standard": {
             "standard": {
                 "query": standard_query.to_dict()
             }
         },
         # Text KNN retriever
-        {
+        "text_knn": {
             "knn": {
                 "filter": geo_filter.to_dict(),
                 "field": "text_embedding",
@@ -63,7 +77,7 @@ def rrf_search(host, api_key, index_name, lat, lon, distance, text_query, k=10,
             }
         },
         # Image KNN retriever
-        {
+        "image_knn": {
             "knn": {
                 "filter": geo_filter.to_dict(),
                 "field": "image_embedding",
@@ -72,25 +86,181 @@ def rrf_search(host, api_key, index_name, lat, lon, distance, text_query, k=10,
                 "num_candidates": num_candidates
             }
         }
-    ]
+    }
+
+
+def build_rrf_search(index_name, lat, lon, distance, text_query, k=KNN_K, num_candidates=KNN_NUM_CANDIDATES,
+                     query_vector=None, park_id=None):
+    """
+    Create an RRF search object bound to a specific index.
+
+    Args:
+        index_name (str): Name of the Elasticsearch index
+        lat (float): Latitude for geo filtering
+        lon (float): Longitude for geo filtering
+        distance (int/str): Distance for geo filtering
+        text_query (str): Text to search in description fields
+        k (int): Number of top results for KNN search
+        num_candidates (int): Number of candidates for KNN search
+        query_vector (list): Precomputed embedding of text_query, computed here if not given
+        park_id (str): Park to filter on instead of the distance around lat/lon
+
+    Returns:
+        Search: elasticsearch_dsl Search object ready to execute
+    """
+    retrievers = build_retrievers(lat, lon, distance, text_query, k=k, num_candidates=num_candidates,
+                                  query_vector=query_vector, park_id=park_id)
+
+    # Create search object bound to index
+    s = Search(index=index_name)
+    s = s.source(SOURCE_FIELDS)
 
     # Apply RRF configuration
-    s = s.extra(retriever={'rrf': {'retrievers': retrievers}}, size=3)
+    s = s.extra(retriever={'rrf': {'retrievers': list(retrievers.values())}}, size=3)
+
+    return s
 
-    es = Elasticsearch(hosts=host, api_key=api_key)
 
-    results = s.using(es).execute()["hits"]["hits"]
+def rrf_search(host, api_key, index_name, lat, lon, distance, text_query, k=KNN_K,
+               num_candidates=KNN_NUM_CANDIDATES, query_vector=None, es_client=None, park_id=None, trace=NULL_TRACE):
+    """
+    Run an RRF search around a location.
+
+    Args:
+        host (str): Elasticsearch host
+        api_key (str): Elasticsearch API key
+        index_name (str): Name of the Elasticsearch index
+        lat (float): Latitude for geo filtering
+        lon (float): Longitude for geo filtering
+        distance (int/str): Distance for geo filtering
+        text_query (str): Text to search in description fields
+        k (int): Number of top results for KNN search
+        num_candidates (int): Number of candidates for KNN search
+        query_vector (list): Precomputed embedding of text_query, computed here if not given
+        es_client (Elasticsearch): Client to use, the shared client for host/api_key if not given
+        park_id (str): Park to filter on instead of the distance around lat/lon
+        trace (Trace): Trace whose current span gets the Elasticsearch took time
+
+    Returns:
+        list: Search hits
+    """
+    s = build_rrf_search(index_name, lat, lon, distance, text_query, k=k, num_candidates=num_candidates,
+                         query_vector=query_vector, park_id=park_id)
+
+    es = es_client or get_es_client(host, api_key)
+
+    response = execute_rrf_search_dsl(es, s)
+    trace.annotate(es_took_ms=response.took)
+    results = response["hits"]["hits"]
 
     return results
 
 
+def rrf_multi_search(host, api_key, index_name, searches, es_client=None, trace=NULL_TRACE):
+    """
+    Run several RRF searches in a single _msearch round trip.
+
+    Args:
+        host (str): Elasticsearch host
+        api_key (str): Elasticsearch API key
+        index_name (str): Name of the Elasticsearch index
+        searches (list): Search objects created with build_rrf_search
+        es_client (Elasticsearch): Client to use, the shared client for host/api_key if not given
+        trace (Trace): Trace whose current span gets the took time of each search
+
+    Returns:
+        list: Search hits for each search in order, or None for a search that failed
+    """
+    ms = MultiSearch(index=index_name)
+    for s in searches:
+        ms = ms.add(s)
+
+    es = es_client or get_es_client(host, api_key)
+
+    responses = ms.using(es).execute(raise_on_error=False)
+    trace.annotate(es_took_ms=",".join(str(response.took) if response is not None else "error"
+                                       for response in responses))
+
+    return [response["hits"]["hits"] if response is not None else None for response in responses]
+
+
+def rrf_search_client_fusion(host, api_key, index_name, lat, lon, distance, text_query, k=KNN_K,
+                             num_candidates=KNN_NUM_CANDIDATES, query_vector=None, es_client=None, weights=None,
+                             rank_constant=60, rank_window_size=10, size=3, park_id=None):
+    """
+    Run the three retrievers in one _msearch batch and fuse them locally with weighted RRF.
+
+    Unlike the server-side rrf retriever, this reports the took time and hit
+    count of every retriever. A retriever with weight 0 is not sent at all.
+
+    Args:
+        host (str): Elasticsearch host
+        api_key (str): Elasticsearch API key
+        index_name (str): Name of the Elasticsearch index
+        lat (float): Latitude for geo filtering
+        lon (float): Longitude for geo filtering
+        distance (int/str): Distance for geo filtering
+        text_query (str): Text to search in description fields
+        k (int): Number of top results for KNN search
+        num_candidates (int): Number of candidates for KNN search
+        query_vector (list): Precomputed embedding of text_query, computed here if not given
+        es_client (Elasticsearch): Client to use, the shared client for host/api_key if not given
+        weights (dict): Weight per retriever name in RETRIEVERS, 1.0 if not given
+        rank_constant (int): RRF rank constant
+        rank_window_size (int): Number of hits considered from each retriever
+        size (int): Number of fused hits returned
+        park_id (str): Park to filter on instead of the distance around lat/lon
+
+    Returns:
+        tuple: (fused hits, {retriever name: {"took": ms, "hits": count, "weight": weight}})
+    """
+    weights = {name: 1.0 for name in RETRIEVERS} | (weights or {})
+    retrievers = build_retrievers(lat, lon, distance, text_query, k=k, num_candidates=num_candidates,
+                                  query_vector=query_vector, park_id=park_id)
+
+    names = [name for name in RETRIEVERS if weights[name] > 0]
+    ms = MultiSearch(index=index_name)
+    for name in names:
+        s = Search(index=index_name).source(SOURCE_FIELDS)
+        if "standard" in retrievers[name]:
+            s = s.update_from_dict(retrievers[name]["standard"]).extra(size=rank_window_size)
+        else:
+            s = s.extra(knn=retrievers[name]["knn"], size=min(k, rank_window_size))
+        ms = ms.add(s)
+
+    es = es_client or get_es_client(host, api_key)
+
+    responses = ms.using(es).execute()
+
+    ranked_lists = []
+    hits_by_id = {}
+    retriever_stats = {}
+    for name, response in zip(names, responses):
+        hits = response.to_dict()["hits"]["hits"]
+        ranked_lists.append([hit["_id"] for hit in hits])
+        for hit in hits:
+            hits_by_id.setdefault(hit["_id"], hit)
+        retriever_stats[name] = {"took": response.took, "hits": len(hits), "weight": weights[name]}
+
+    fused = reciprocal_rank_fusion(ranked_lists, weights=[weights[name] for name in names],
+                                   rank_constant=rank_constant, rank_window_size=rank_window_size)
+
+    results = []
+    for doc_id, score in fused[:size]:
+        hit = dict(hits_by_id[doc_id])
+        hit["_score"] = score
+        results.append(hit)
+
+    return results, retriever_stats
+
+
 def execute_rrf_search_dsl(es_client, search_obj):
     """
     Execute the RRF search using elasticsearch_dsl.
 
     Args:
         es_client: Elasticsearch client instance
-        search_obj: Search object created with create_rrf_search_from_index
+        search_obj: Search object created with build_rrf_search
 
     Returns:
         Response: elasticsearch_dsl Response object
@@ -0,0 +1,26 @@
+def reciprocal_rank_fusion(ranked_lists, weights=None, rank_constant=60, rank_window_size=10):
+    """
+    Fuse ranked result lists with (weighted) reciprocal rank fusion.
+
+    Each document scores sum(weight / (rank_constant + rank)) over the lists
+    it appears in, using 1-based ranks within the first rank_window_size
+    entries of each list, as the Elasticsearch rrf retriever does.
+
+    Args:
+        ranked_lists (list): Lists of document ids, best first
+        weights (list): Weight of each list, 1.0 for all if not given
+        rank_constant (int): Constant damping the influence of top ranks
+        rank_window_size (int): Number of entries considered from each list
+
+    Returns:
+        list: (document id, score) tuples sorted by descending score
+    """
+    if weights is None:
+        weights = [1.0] * len(ranked_lists)
+
+    scores = {}
+    for ranked, weight in zip(ranked_lists, weights):
+        for rank, doc_id in enumerate(ranked[:rank_window_size], start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight / (rank_constant + rank)
+
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
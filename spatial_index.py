@@ -0,0 +1,199 @@
+import json
+import math
+import os
+import threading
+from collections import Counter
+
+import numpy as np
+
+from local_search import haversine_km
+
+
+SPATIAL_INDEX_PATH = os.getenv('SPATIAL_INDEX', 'spatial_index.json')
+# Precision 5 cells are about 4.9 x 4.9 km at the equator
+GEOHASH_PRECISION = int(os.getenv('SPATIAL_INDEX_PRECISION', 5))
+# Safety margin on the tightened radius for differences in earth models and rounding
+RADIUS_MARGIN = 1.01
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    geohash, bits, value, even = [], 0, 0, True
+    while len(geohash) < precision:
+        interval, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            geohash.append(_BASE32[value])
+            bits, value = 0, 0
+    return "".join(geohash)
+
+
+def geohash_bounds(geohash):
+    """
+    Bounding box of a geohash cell.
+
+    Returns:
+        tuple: (min_lat, min_lon, max_lat, max_lon)
+    """
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _BASE32.index(char)
+        for shift in range(4, -1, -1):
+            interval = lon_range if even else lat_range
+            middle = (interval[0] + interval[1]) / 2
+            if value >> shift & 1:
+                interval[0] = middle
+            else:
+                interval[1] = middle
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+class SpatialIndex:
+    """
+    Document counts per geohash cell and per park, summarizing where the indexed photos are.
+
+    A search circle that overlaps no non-empty cell cannot match any
+    document, and the farthest corner of the non-empty cells it overlaps
+    bounds the radius actually needed to reach all of its documents.
+    """
+
+    def __init__(self, cells, park_counts=None, precision=GEOHASH_PRECISION):
+        self.cells = dict(cells)
+        self.park_counts = dict(park_counts or {})
+        self.precision = precision
+
+        bounds = np.array([geohash_bounds(cell) for cell in self.cells], dtype=np.float64).reshape(-1, 4)
+        self._min_lat, self._min_lon, self._max_lat, self._max_lon = bounds.T
+        self._counts = np.array(list(self.cells.values()), dtype=np.int64)
+
+    @classmethod
+    def build(cls, points, precision=GEOHASH_PRECISION):
+        """
+        Args:
+            points (iterable): (lat, lon, park_ids) per document
+
+        Returns:
+            SpatialIndex: Counts of the documents per cell and park
+        """
+        cells, park_counts = Counter(), Counter()
+        for lat, lon, park_ids in points:
+            cells[geohash_encode(lat, lon, precision)] += 1
+            park_counts.update(park_ids or [])
+        return cls(cells, park_counts, precision)
+
+    @classmethod
+    def from_metadata(cls, metadata_dir='images_metadata/', precision=GEOHASH_PRECISION):
+        """Summarize the geolocation and park membership of every metadata file"""
+        from park_shapes import load_park_shapes
+
+        shapes = load_park_shapes()
+        points = []
+        for json_file in sorted(os.listdir(metadata_dir)):
+            if not json_file.endswith('.json'):
+                continue
+            with open(os.path.join(metadata_dir, json_file), 'r') as file:
+                location = json.load(file)['geolocation']
+            points.append((location['lat'], location['lon'], shapes.parks_containing(location['lat'], location['lon'])))
+        return cls.build(points, precision)
+
+    def save(self, path=SPATIAL_INDEX_PATH):
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump({"precision": self.precision, "cells": self.cells, "park_counts": self.park_counts}, file)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=SPATIAL_INDEX_PATH):
+        with open(path, 'r') as file:
+            data = json.load(file)
+        return cls(data['cells'], data['park_counts'], data['precision'])
+
+    def within(self, lat, lon, radius_km):
+        """
+        Bound the documents inside a search circle.
+
+        Args:
+            lat (float): Latitude of the circle center
+            lon (float): Longitude of the circle center
+            radius_km (float): Circle radius in kilometers
+
+        Returns:
+            tuple: (upper bound of the documents inside, radius in km that
+            still reaches every one of them, at most radius_km)
+        """
+        if not len(self._counts):
+            return 0, 0.0
+
+        # Nearest point of each cell to the center
+        nearest = haversine_km(lat, lon, np.clip(lat, self._min_lat, self._max_lat),
+                               np.clip(lon, self._min_lon, self._max_lon))
+        overlapping = nearest <= radius_km
+        if not overlapping.any():
+            return 0, 0.0
+
+        corners = np.max([haversine_km(lat, lon, corner_lat[overlapping], corner_lon[overlapping])
+                          for corner_lat in (self._min_lat, self._max_lat)
+                          for corner_lon in (self._min_lon, self._max_lon)], axis=0)
+        needed = min(radius_km, math.ceil(corners.max() * RADIUS_MARGIN))
+        return int(self._counts[overlapping].sum()), float(needed)
+
+    def plan(self, park_centers, radius_km, park_filters=None):
+        """
+        Decide which park searches are worth sending and with which radius.
+
+        Args:
+            park_centers (dict): (lat, lon) per park id
+            radius_km (float): Requested search radius in kilometers
+            park_filters (dict): Park ids searched by park_id membership instead of distance
+
+        Returns:
+            dict: Effective radius in km per park, None for parks with no documents
+        """
+        park_filters = park_filters or {}
+        plan = {}
+        for park_id, (lat, lon) in park_centers.items():
+            if park_filters.get(park_id):
+                plan[park_id] = radius_km if self.park_counts.get(park_id) else None
+                continue
+            count, needed = self.within(lat, lon, radius_km)
+            plan[park_id] = needed if count else None
+        return plan
+
+
+# path -> (file identity, SpatialIndex) of the summaries loaded so far
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+def load_spatial_index(path=SPATIAL_INDEX_PATH):
+    """
+    The spatial summary written at indexing time, or None when there is none.
+
+    The file is reloaded whenever upload_documents replaces it, so a
+    long-running app or query service never prunes parks with a stale
+    summary. Checking costs one stat per call.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    # save() replaces the file, so a rewrite changes the inode even within the mtime resolution
+    identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    with _loaded_lock:
+        loaded = _loaded.get(path)
+        if loaded is None or loaded[0] != identity:
+            loaded = _loaded[path] = (identity, SpatialIndex.load(path))
+    return loaded[1]
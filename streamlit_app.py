@@ -1,8 +1,12 @@
 import streamlit as st
+import json
 import os
-from PIL import Image
+import time
+import urllib.request
 from typing import List, Dict, Any
-from LLM_conversation import process_parks_query
+from es_client import get_es_client
+from thumbnails import IMAGE_ROOT, get_thumbnail, placeholder_thumbnail
+from tracing import Trace, start_metrics_server
 from dotenv import load_dotenv
 
 
@@ -53,19 +57,123 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 
-def load_image_safe(image_path: str) -> Image.Image:
-    """Safely load an image with fallback to placeholder"""
+@st.cache_resource
+def get_search_client(host: str, api_key: str):
+    """Pooled Elasticsearch client shared by every session and rerun"""
+    return get_es_client(host, api_key)
+
+
+@st.cache_resource
+def get_metrics_server(port: int):
+    """Prometheus /metrics endpoint, started once per process"""
+    return start_metrics_server(port)
+
+
+@st.cache_data(max_entries=1024, show_spinner=False)
+def load_thumbnail(image_filename: str, image_root: str) -> bytes:
+    """Size-bounded thumbnail bytes for an image, with fallback to placeholder"""
+    try:
+        return get_thumbnail(image_filename, image_root)
+    except Exception as e:
+        print(f"Error loading image {image_filename}: {e}")
+        return placeholder_thumbnail()
+
+
+def remote_parks_query(service_url: str, query: str, generation_stats: Dict[str, Any], trace: Trace):
+    """
+    Run a query on the query service, with the same streaming contract as process_parks_query.
+
+    Returns:
+        tuple: (token iterator, search results); generation_stats and trace
+        are filled in when the token stream ends
+    """
+    payload = {"query": query, "stream": True}
+    # Modes set for this app are forwarded; otherwise the service's own defaults apply
+    for name in ("fusion_mode", "geo_filter_mode"):
+        if os.getenv(name.upper()):
+            payload[name] = os.getenv(name.upper())
+    request = urllib.request.Request(service_url.rstrip('/') + '/query', data=json.dumps(payload).encode(),
+                                     headers={"Content-Type": "application/json"})
+    response = urllib.request.urlopen(request, timeout=float(os.getenv('QUERY_SERVICE_TIMEOUT', 300)))
+    messages = (json.loads(line) for line in response)
+    search_results = next(messages)["results"]
+
+    def tokens():
+        with response:
+            for message in messages:
+                if "token" in message:
+                    yield message["token"]
+                elif "error" in message:
+                    yield f"\n\n{message['error']}"
+                else:
+                    generation_stats.update(message["generation_stats"])
+                    trace.merge(message["trace"])
+
+    return tokens(), search_results
+
+
+def local_parks_query(host: str, api_key: str, query: str, generation_stats: Dict[str, Any], trace: Trace):
+    """Run a query in this process when no query service is configured"""
+    # Imported here so the app stays a thin client, without the CLIP and LLM stack, in service mode
+    from LLM_conversation import FUSION_MODE, GEO_FILTER_MODE, process_parks_query
+    return process_parks_query(query, host, api_key, es_client=get_search_client(host, api_key), stream=True,
+                               generation_stats=generation_stats, trace=trace, fusion_mode=FUSION_MODE,
+                               geo_filter_mode=GEO_FILTER_MODE)
+
+
+def query_stats(service_url: str) -> Dict[str, Any]:
+    """
+    Answer cache and search parameter extraction stats from wherever queries run.
+
+    Returns:
+        dict: {"answer_cache": ..., "extraction": ...}, or {} when the query service is unreachable
+    """
+    if not service_url:
+        from LLM_conversation import answer_cache, extraction_report
+        return {"answer_cache": answer_cache.stats(), "extraction": extraction_report()}
     try:
-        if os.path.exists(image_path):
-            return Image.open(image_path)
-        else:
-            # Create a placeholder image if file doesn't exist
-            placeholder = Image.new('RGB', (300, 200), color='lightgray')
-            return placeholder
+        with urllib.request.urlopen(service_url.rstrip('/') + '/stats', timeout=5) as response:
+            return json.load(response)
     except Exception as e:
-        st.error(f"Error loading image {image_path}: {e}")
-        placeholder = Image.new('RGB', (300, 200), color='lightgray')
-        return placeholder
+        print(f"Error fetching query service stats: {e}")
+        return {}
+
+
+def render_response(placeholder, response: str):
+    """Render the assistant response box into a placeholder"""
+    placeholder.markdown(f"""
+        <div style="background-color: #f8f9fa; color: #212529; padding: 20px; border-radius: 10px; border: 1px solid #dee2e6; margin: 10px 0;">
+        {response}
+        </div>
+        """, unsafe_allow_html=True)
+
+
+def stream_response(placeholder, tokens) -> str:
+    """Render tokens into the response box as they arrive and return the full response"""
+    response = ""
+    for token in tokens:
+        response += token
+        render_response(placeholder, response)
+    return response
+
+
+def display_trace(trace: Trace):
+    """Show per-stage timings, Elasticsearch took vs wall time, cache hits and token counts"""
+    st.markdown("**Stage timings**")
+    for stage, duration_ms in trace.stage_durations().items():
+        st.text(f"{stage}: {duration_ms:.0f} ms")
+
+    for span in trace.spans:
+        if span["name"] == "rrf_search" and "es_took_ms" in span["attributes"]:
+            st.text(f"{span['attributes'].get('park_id', '')}: ES took {span['attributes']['es_took_ms']} ms, "
+                    f"wall {span['duration_ms']:.0f} ms")
+
+    counters = trace.counters
+    st.text(f"Embedding cache: {counters.get('embedding_cache_hits', 0)} hits, "
+            f"{counters.get('embedding_cache_misses', 0)} misses")
+    st.text(f"Tokens: {counters.get('prompt_tokens', 0)} prompt, {counters.get('completion_tokens', 0)} completion")
+    st.download_button("Download trace (OTLP JSON)", json.dumps(trace.to_otel()),
+                       file_name=f"trace_{trace.trace_id}.json", mime="application/json")
 
 
 def format_park_name(park_id: str) -> str:
@@ -80,6 +188,8 @@ def display_search_results(search_results: List[Dict[str, Any]]):
         return
 
     st.subheader("🏞️ Recommended Locations")
+    render_start = time.perf_counter()
+    payload_bytes = 0
 
 
     # Group results by park_id to avoid duplicates
@@ -107,12 +217,10 @@ def display_search_results(search_results: List[Dict[str, Any]]):
                     # Format park name
                     park_name = format_park_name(park_id)
 
-                    # Image path
-                    image_path = f"/Users/alexanderdavila/PycharmProjects/MMRAG_blog/pythonProject1/images_metadata/{image_filename}"
-
-                    # Load and display image
-                    image = load_image_safe(image_path)
-                    st.image(image_path, use_container_width=True, caption=title)
+                    # Load and display the cached thumbnail
+                    thumbnail = load_thumbnail(image_filename, IMAGE_ROOT)
+                    payload_bytes += len(thumbnail)
+                    st.image(thumbnail, use_container_width=True, caption=title)
 
                     # Display park information
                     st.markdown(f"""
@@ -122,12 +230,18 @@ def display_search_results(search_results: List[Dict[str, Any]]):
                     </div>
                     """, unsafe_allow_html=True)
 
+    st.caption(f"{len(search_results)} images, {payload_bytes / 1024:.0f} KB of image payload, "
+               f"rendered in {1000 * (time.perf_counter() - render_start):.0f} ms")
+
 
 def main():
     load_dotenv()
     host = os.getenv('ES_HOST')
     api_key = os.getenv('ES_API_KEY')
     index = os.getenv('ES_INDEX')
+    service_url = os.getenv('QUERY_SERVICE_URL')
+    if os.getenv('METRICS_PORT'):
+        get_metrics_server(int(os.getenv('METRICS_PORT')))
     # App header
     st.title("🏔️ National Parks Activity Finder")
     st.markdown("Discover amazing activities and locations in America's National Parks!")
@@ -137,6 +251,10 @@ def main():
         st.session_state.search_results = []
     if 'llm_response' not in st.session_state:
         st.session_state.llm_response = ""
+    if 'generation_stats' not in st.session_state:
+        st.session_state.generation_stats = {}
+    if 'trace' not in st.session_state:
+        st.session_state.trace = None
 
     # Search section
     st.markdown("### 🔍 Search for Activities")
@@ -160,37 +278,50 @@ def main():
     if clear_button:
         st.session_state.search_results = []
         st.session_state.llm_response = ""
+        st.session_state.generation_stats = {}
+        st.session_state.trace = None
         st.rerun()
 
     # Process search
+    streamed = False
     if search_button and query.strip():
-        with st.spinner("Searching national parks..."):
-            try:
+        try:
+            generation_stats = {}
+            trace = Trace()
+            with st.spinner("Searching national parks..."):
+                if service_url:
+                    tokens, search_results = remote_parks_query(service_url, query, generation_stats, trace)
+                else:
+                    tokens, search_results = local_parks_query(host, api_key, query, generation_stats, trace)
+
+            st.session_state.search_results = search_results
 
-                response, search_results = process_parks_query(query, host, api_key)
+            # Show the images as soon as retrieval is done and stream the answer above them
+            st.markdown("### 🤖 AI Assistant Response")
+            response_placeholder = st.empty()
+            render_response(response_placeholder, "Generating response...")
+            display_search_results(search_results)
 
-                st.session_state.llm_response = response
-                st.session_state.search_results = search_results
+            st.session_state.llm_response = stream_response(response_placeholder, tokens)
+            st.session_state.generation_stats = generation_stats
+            st.session_state.trace = trace
+            streamed = True
 
-                st.success("Search completed!")
+            st.success("Search completed!")
 
-            except Exception as e:
-                st.error(f"An error occurred during search: {str(e)}")
+        except Exception as e:
+            st.error(f"An error occurred during search: {str(e)}")
 
     elif search_button and not query.strip():
         st.warning("Please enter a search query.")
 
     # Display LLM response
-    if st.session_state.llm_response:
+    if st.session_state.llm_response and not streamed:
         st.markdown("### 🤖 AI Assistant Response")
-        st.markdown(f"""
-        <div style="background-color: #f8f9fa; color: #212529; padding: 20px; border-radius: 10px; border: 1px solid #dee2e6; margin: 10px 0;">
-        {st.session_state.llm_response}
-        </div>
-        """, unsafe_allow_html=True)
+        render_response(st, st.session_state.llm_response)
 
     # Display search results
-    if st.session_state.search_results:
+    if st.session_state.search_results and not streamed:
         display_search_results(st.session_state.search_results)
 
     # Sidebar with app information
@@ -216,6 +347,27 @@ def main():
             st.metric("Results Found", len(st.session_state.search_results))
             unique_parks = len(set(r['park_id'] for r in st.session_state.search_results))
             st.metric("Parks Covered", unique_parks)
+        generation_stats = st.session_state.generation_stats
+        if 'time_to_first_token' in generation_stats:
+            st.metric("Time to First Token", f"{generation_stats['time_to_first_token']:.2f} s")
+        if 'generation_seconds' in generation_stats:
+            st.metric("Generation Time", f"{generation_stats['generation_seconds']:.2f} s")
+        if generation_stats.get('context'):
+            context = generation_stats['context']
+            st.text(f"Prompt context: {context['results_used']}/{context['results']} results, "
+                    f"~{context['tokens_before']} -> ~{context['tokens_after']} tokens")
+        if st.session_state.trace is not None:
+            display_trace(st.session_state.trace)
+        stats = query_stats(service_url)
+        cache_stats = stats.get("answer_cache")
+        if cache_stats and cache_stats["hits"] + cache_stats["misses"]:
+            st.metric("Answer Cache Hit Rate", f"{100 * cache_stats['hit_rate']:.0f}%")
+            if cache_stats["hit_similarity"]:
+                st.text(f"Hit similarity: min {cache_stats['hit_similarity']['min']:.3f}, "
+                        f"median {cache_stats['hit_similarity']['p50']:.3f}")
+        extraction = stats.get("extraction")
+        if extraction and extraction["queries"]:
+            st.metric("Queries Parsed Without LLM", f"{100 * extraction['share_without_llm']:.0f}%")
 
 
 if __name__ == "__main__":
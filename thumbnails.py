@@ -0,0 +1,58 @@
+import io
+import os
+from PIL import Image
+
+
+IMAGE_ROOT = os.getenv('IMAGE_ROOT', 'images_metadata')
+THUMBNAIL_DIR = os.getenv('THUMBNAIL_DIR', 'thumbnails')
+THUMBNAIL_MAX_SIZE = (480, 480)
+THUMBNAIL_FORMAT = "WEBP"
+THUMBNAIL_QUALITY = 80
+
+
+def thumbnail_path(image_filename, thumbnail_dir=THUMBNAIL_DIR):
+    return os.path.join(thumbnail_dir, os.path.splitext(image_filename)[0] + '.' + THUMBNAIL_FORMAT.lower())
+
+
+def ensure_thumbnail(image_filename, image_root=IMAGE_ROOT, thumbnail_dir=THUMBNAIL_DIR,
+                     max_size=THUMBNAIL_MAX_SIZE):
+    """
+    Create the size-bounded thumbnail of an image if it is missing or stale.
+
+    Args:
+        image_filename (str): Image file name inside image_root
+        image_root (str): Directory holding the full-resolution images
+        thumbnail_dir (str): Directory holding the thumbnails
+        max_size (tuple): Maximum (width, height) of the thumbnail
+
+    Returns:
+        str: Path of the thumbnail
+    """
+    source = os.path.join(image_root, image_filename)
+    target = thumbnail_path(image_filename, thumbnail_dir)
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+        return target
+
+    os.makedirs(thumbnail_dir, exist_ok=True)
+    with Image.open(source) as image:
+        # Let the JPEG decoder downscale while decoding instead of decoding full resolution
+        image.draft('RGB', max_size)
+        image = image.convert('RGB')
+        image.thumbnail(max_size)
+
+        tmp_path = target + '.tmp'
+        image.save(tmp_path, format=THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+    os.replace(tmp_path, target)
+    return target
+
+
+def get_thumbnail(image_filename, image_root=IMAGE_ROOT, thumbnail_dir=THUMBNAIL_DIR):
+    """Thumbnail bytes for an image, generated on first request"""
+    with open(ensure_thumbnail(image_filename, image_root, thumbnail_dir), 'rb') as file:
+        return file.read()
+
+
+def placeholder_thumbnail(size=(300, 200)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color='lightgray').save(buffer, format=THUMBNAIL_FORMAT)
+    return buffer.getvalue()
@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Trace:
+    """
+    Timed spans and counters collected for one query.
+
+    Spans nest; annotate() adds attributes to the innermost open span.
+    Pass NULL_TRACE instead when tracing is disabled.
+    """
+    enabled = True
+
+    def __init__(self, name="process_parks_query"):
+        self.name = name
+        self.trace_id = os.urandom(16).hex()
+        self.spans = []
+        self.counters = {}
+        self._stack = []
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span = {"name": name, "span_id": os.urandom(8).hex(),
+                "parent_id": self._stack[-1]["span_id"] if self._stack else None,
+                "start_unix_nano": time.time_ns(), "attributes": attributes}
+        start = time.perf_counter()
+        self._stack.append(span)
+        try:
+            yield span
+        finally:
+            self._stack.pop()
+            span["duration_ms"] = 1000 * (time.perf_counter() - start)
+            span["end_unix_nano"] = span["start_unix_nano"] + int(span["duration_ms"] * 1e6)
+            self.spans.append(span)
+
+    def annotate(self, **attributes):
+        if self._stack:
+            self._stack[-1]["attributes"].update(attributes)
+
+    def add(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def stage_durations(self):
+        """Total milliseconds per span name"""
+        durations = {}
+        for span in self.spans:
+            durations[span["name"]] = durations.get(span["name"], 0.0) + span["duration_ms"]
+        return durations
+
+    def to_dict(self):
+        return {"trace_id": self.trace_id, "spans": self.spans, "counters": self.counters}
+
+    def merge(self, data):
+        """Adopt the spans and counters of a serialized trace, e.g. one recorded by the query service"""
+        self.trace_id = data["trace_id"]
+        self.spans.extend(data["spans"])
+        for name, value in data["counters"].items():
+            self.add(name, value)
+
+    def to_otel(self):
+        """The trace as an OTLP/JSON ExportTraceServiceRequest"""
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        spans = [{
+            "traceId": self.trace_id,
+            "spanId": span["span_id"],
+            "parentSpanId": span["parent_id"] or "",
+            "name": span["name"],
+            "kind": 1,
+            "startTimeUnixNano": str(span["start_unix_nano"]),
+            "endTimeUnixNano": str(span["end_unix_nano"]),
+            "attributes": [attribute(key, value) for key, value in span["attributes"].items()]
+        } for span in self.spans]
+
+        return {"resourceSpans": [{
+            "resource": {"attributes": [attribute("service.name", "national-parks-rag")]},
+            "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}]
+        }]}
+
+
+class _NullSpan:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullTrace:
+    """Disabled trace: every call is a no-op"""
+    enabled = False
+    _null_span = _NullSpan()
+
+    def span(self, name, **attributes):
+        return self._null_span
+
+    def annotate(self, **attributes):
+        pass
+
+    def add(self, name, value=1):
+        pass
+
+
+NULL_TRACE = NullTrace()
+
+
+class MetricsRegistry:
+    """Process-wide aggregate of recorded traces in Prometheus text format"""
+
+    def __init__(self, prefix="parks_rag"):
+        self.prefix = prefix
+        self.stage_count = {}
+        self.stage_sum_seconds = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        if not trace.enabled:
+            return
+        with self._lock:
+            for span in trace.spans:
+                self.stage_count[span["name"]] = self.stage_count.get(span["name"], 0) + 1
+                self.stage_sum_seconds[span["name"]] = (self.stage_sum_seconds.get(span["name"], 0.0)
+                                                        + span["duration_ms"] / 1000)
+            for name, value in trace.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_prometheus(self):
+        with self._lock:
+            lines = [f"# HELP {self.prefix}_stage_seconds Time spent per pipeline stage",
+                     f"# TYPE {self.prefix}_stage_seconds summary"]
+            for stage in sorted(self.stage_count):
+                lines.append(f'{self.prefix}_stage_seconds_count{{stage="{stage}"}} {self.stage_count[stage]}')
+                lines.append(f'{self.prefix}_stage_seconds_sum{{stage="{stage}"}} {self.stage_sum_seconds[stage]}')
+            for name in sorted(self.counters):
+                lines.append(f"# TYPE {self.prefix}_{name}_total counter")
+                lines.append(f"{self.prefix}_{name}_total {self.counters[name]}")
+        return "\n".join(lines) + "\n"
+
+
+metrics_registry = MetricsRegistry()
+
+
+def start_metrics_server(port, registry=metrics_registry):
+    """
+    Serve the registry on http://0.0.0.0:<port>/metrics for Prometheus scraping.
+
+    Returns:
+        ThreadingHTTPServer: The running server
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
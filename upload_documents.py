@@ -1,6 +1,30 @@
 from clip_processor import *
 from elasticsearch import Elasticsearch
+from elasticsearch.helpers import streaming_bulk, parallel_bulk
+from es_client import get_es_client
+from index_management import create_index, force_merge, write_index
+from spatial_index import SPATIAL_INDEX_PATH, SpatialIndex
+from corpus_pack import CorpusPack
+from index_manifest import IndexManifest, document_fingerprint
+from embedding_store import EmbeddingStore
+from thumbnails import ensure_thumbnail
+import multiprocessing
 import os
+import json
+import time
+
+
+# Bulk loading defaults
+CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', 200))
+MAX_CHUNK_BYTES = int(os.getenv('BULK_MAX_CHUNK_BYTES', 50 * 1024 * 1024))
+MAX_RETRIES = 5
+INITIAL_BACKOFF = 2
+MAX_BACKOFF = 60
+MANIFEST_SAVE_EVERY = 100
+
+# Process-pool ingestion, 1 worker embeds in the bulk-writer process
+INGEST_WORKERS = int(os.getenv('INGEST_WORKERS', 1))
+INGEST_THREADS_PER_WORKER = int(os.getenv('INGEST_THREADS_PER_WORKER', 0))  # 0: cores / workers
 
 
 def list_metadata_files(path):
@@ -21,19 +45,307 @@ def upload_document(es: Elasticsearch, doc, index):
         print(f"Failed to upload file {doc['image_filename']}")
 
 
+def generate_actions(metadata_files, index, stats, batch_size=DEFAULT_BATCH_SIZE, store=None):
+    """
+    Embed metadata files in batches and yield bulk index actions.
+
+    Args:
+        metadata_files (list): Metadata file names inside images_metadata/
+        index (str): Target index name
+        stats (dict): Counters updated with the number of docs and bytes yielded
+        batch_size (int): Number of documents embedded per forward pass
+        store (EmbeddingStore): Optional embedding store checked before running the model
+
+    Yields:
+        dict: Bulk action for one document
+    """
+    for start in range(0, len(metadata_files), batch_size):
+        for doc in add_embeddings_batch(metadata_files[start:start + batch_size], batch_size=batch_size,
+                                        store=store):
+            ensure_thumbnail(doc['image_filename'])
+            stats['docs'] += 1
+            stats['bytes'] += len(json.dumps(doc))
+            yield {"_index": index, "_id": doc['photo_id'], "_source": doc}
+
+
+class _DeferredStore:
+    """Read-only view of an EmbeddingStore that keeps new embeddings for the writer process"""
+
+    def __init__(self, store):
+        self.store = store
+        self.pending_keys = []
+        self.pending_embeddings = []
+
+    def key(self, model_name, content_hash):
+        return self.store.key(model_name, content_hash)
+
+    def get_many(self, keys):
+        return self.store.get_many(keys)
+
+    def put_many(self, keys, embeddings):
+        self.pending_keys.extend(keys)
+        self.pending_embeddings.extend(np.asarray(embeddings, dtype=np.float32))
+
+    def drain(self):
+        pending = self.pending_keys, self.pending_embeddings
+        self.pending_keys, self.pending_embeddings = [], []
+        return pending
+
+
+_worker_store = None
+
+
+def _init_worker(threads, core_queue, store_path):
+    global _worker_store
+    cores = core_queue.get()
+    if cores and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ['MKL_NUM_THREADS'] = str(threads)
+
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+    if store_path is not None:
+        _worker_store = _DeferredStore(EmbeddingStore(store_path, readonly=True))
+
+
+def _embed_shard(json_files, batch_size):
+    docs = add_embeddings_batch(json_files, batch_size=batch_size, store=_worker_store)
+    for doc in docs:
+        ensure_thumbnail(doc['image_filename'])
+    pending = _worker_store.drain() if _worker_store is not None else ([], [])
+    return docs, pending
+
+
+def _embed_shard_args(args):
+    return _embed_shard(*args)
+
+
+def generate_actions_multiprocess(metadata_files, index, stats, workers, threads_per_worker=0,
+                                  batch_size=DEFAULT_BATCH_SIZE, store=None):
+    """
+    Embed metadata files in a process pool and yield bulk index actions.
+
+    Each worker is pinned to its own set of cores, runs torch with that many
+    intra-op threads and loads the model once. Batches are embedded in
+    parallel and streamed back in order, so the caller stays the single
+    bulk writer. Workers only read the embedding store; embeddings they
+    compute are appended to it here.
+
+    Args:
+        metadata_files (list): Metadata file names inside images_metadata/
+        index (str): Target index name
+        stats (dict): Counters updated with the number of docs and bytes yielded
+        workers (int): Number of worker processes
+        threads_per_worker (int): Torch threads and pinned cores per worker, 0 splits the cores evenly
+        batch_size (int): Number of documents embedded per forward pass
+        store (EmbeddingStore): Optional embedding store checked before running the model
+
+    Yields:
+        dict: Bulk action for one document
+    """
+    cores = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    threads_per_worker = threads_per_worker or max(1, len(cores) // workers)
+
+    context = multiprocessing.get_context('spawn')
+    core_queue = context.Queue()
+    for worker in range(workers):
+        start = worker * threads_per_worker
+        # Oversubscribed configurations are left unpinned
+        core_queue.put(cores[start:start + threads_per_worker] if start + threads_per_worker <= len(cores) else None)
+
+    shards = [metadata_files[start:start + batch_size] for start in range(0, len(metadata_files), batch_size)]
+    with context.Pool(workers, initializer=_init_worker,
+                      initargs=(threads_per_worker, core_queue, store.path if store is not None else None)) as pool:
+        for docs, (keys, embeddings) in pool.imap(_embed_shard_args, [(shard, batch_size) for shard in shards]):
+            if store is not None and keys:
+                store.put_many(keys, np.asarray(embeddings))
+            for doc in docs:
+                stats['docs'] += 1
+                stats['bytes'] += len(json.dumps(doc))
+                yield {"_index": index, "_id": doc['photo_id'], "_source": doc}
+
+
+def generate_actions_from_pack(pack: CorpusPack, photo_ids, index, stats, chunk_size=CHUNK_SIZE):
+    """
+    Yield bulk index actions for documents of a corpus pack, reading it in sequential chunks.
 
-def index_logic():
+    Args:
+        pack (CorpusPack): Packed corpus with embeddings
+        photo_ids (set): Documents to send
+        index (str): Target index name
+        stats (dict): Counters updated with the number of docs and bytes yielded
+        chunk_size (int): Rows decoded from the pack at a time
+
+    Yields:
+        dict: Bulk action for one document
+    """
+    for documents in pack.iter_documents(chunk_size, as_lists=True):
+        for doc in documents:
+            if doc['photo_id'] not in photo_ids:
+                continue
+            ensure_thumbnail(doc['image_filename'])
+            stats['docs'] += 1
+            stats['bytes'] += len(json.dumps(doc))
+            yield {"_index": index, "_id": doc['photo_id'], "_source": doc}
+
+
+def select_changed_files(metadata_files, manifest: IndexManifest):
+    """
+    Find the metadata files whose content changed since they were last indexed.
+
+    Args:
+        metadata_files (list): Metadata file names inside images_metadata/
+        manifest (IndexManifest): Manifest of the documents already indexed
+
+    Returns:
+        tuple: (changed file names, {photo_id: fingerprint} for the changed files)
+    """
+    changed_files = []
+    fingerprints = {}
+    for json_file in metadata_files:
+        with open('images_metadata/' + json_file, 'r') as file:
+            data = json.load(file)
+
+        fingerprint = document_fingerprint(data, image_embedding_model_key())
+        if manifest.is_current(data['photo_id'], fingerprint):
+            continue
+
+        changed_files.append(json_file)
+        fingerprints[data['photo_id']] = fingerprint
+
+    return changed_files, fingerprints
+
+
+def _get_refresh_interval(es: Elasticsearch, index):
+    # None when the index uses the default; putting None back resets the setting instead of pinning
+    # the default as an explicit value, which would also disable the idle-shard refresh skipping
+    settings = es.indices.get_settings(index=index, name="index.refresh_interval")
+    return settings[index].get("settings", {}).get("index", {}).get("refresh_interval")
+
+
+def _set_refresh_interval(es: Elasticsearch, index, interval):
+    es.indices.put_settings(index=index, settings={"index": {"refresh_interval": interval}})
+
+
+def bulk_upload(es: Elasticsearch, actions, chunk_size=CHUNK_SIZE, max_chunk_bytes=MAX_CHUNK_BYTES,
+                parallel=False, thread_count=4):
+    """
+    Stream actions to Elasticsearch with the bulk helpers.
+
+    streaming_bulk retries 429 rejections with exponential backoff. parallel_bulk
+    sends chunks from several threads but does not retry rejected documents.
+
+    Args:
+        es (Elasticsearch): Elasticsearch client
+        actions (iterable): Bulk actions to send
+        chunk_size (int): Maximum number of documents per bulk request
+        max_chunk_bytes (int): Maximum size in bytes of a bulk request
+        parallel (bool): Use parallel_bulk instead of streaming_bulk
+        thread_count (int): Number of threads used by parallel_bulk
+
+    Yields:
+        tuple: (ok, item) for every document sent
+    """
+    if parallel:
+        return parallel_bulk(es, actions, thread_count=thread_count, chunk_size=chunk_size,
+                             max_chunk_bytes=max_chunk_bytes, raise_on_error=False,
+                             raise_on_exception=False)
+
+    return streaming_bulk(es, actions, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes,
+                          max_retries=MAX_RETRIES, initial_backoff=INITIAL_BACKOFF, max_backoff=MAX_BACKOFF,
+                          raise_on_error=False, raise_on_exception=False, yield_ok=True)
+
+
+def write_spatial_index(metadata_dir='images_metadata/', path=SPATIAL_INDEX_PATH, pack=None):
+    """Summarize where the indexed photos are, so searches can skip parks without any"""
+    if pack is not None:
+        spatial_index = SpatialIndex.build(zip(pack.column('lat'), pack.column('lon'), pack.park_ids()))
+    else:
+        spatial_index = SpatialIndex.from_metadata(metadata_dir)
+    spatial_index.save(path)
+    print(f"Wrote spatial index of {sum(spatial_index.cells.values())} documents "
+          f"in {len(spatial_index.cells)} cells to {path}")
+
+
+def index_logic(chunk_size=CHUNK_SIZE, max_chunk_bytes=MAX_CHUNK_BYTES, parallel=False, thread_count=4,
+                index=None, force_merge_after=os.getenv('FORCE_MERGE_AFTER_LOAD', '1') == '1',
+                workers=INGEST_WORKERS, threads_per_worker=INGEST_THREADS_PER_WORKER,
+                corpus_pack=os.getenv('CORPUS_PACK')):
     host = os.getenv('ES_HOST')
     api_key = os.getenv('ES_API_KEY')
-    index = os.getenv('ES_INDEX')
+    index = index or os.getenv('ES_INDEX')
+
+    es = get_es_client(host, api_key)
+    create_index(es, index)
+    # After index_management.py reindex, ES_INDEX is an alias; the manifest and settings follow the index behind it
+    index = write_index(es, index)
+
+    manifest = IndexManifest(os.getenv('INDEX_MANIFEST', f"index_manifest_{index}.json"))
+    pack = None
+    if corpus_pack:
+        # Everything comes from the pack: no metadata files are opened and no images hashed
+        pack = CorpusPack(corpus_pack)
+        if pack.model != image_embedding_model_key():
+            raise ValueError(f"{corpus_pack} holds {pack.model} embeddings, expected {image_embedding_model_key()}; "
+                             f"rebuild it with corpus_pack.py")
+        fingerprints = {photo_id: fingerprint for photo_id, fingerprint in pack.fingerprints().items()
+                        if not manifest.is_current(photo_id, fingerprint)}
+    else:
+        metadata_files, fingerprints = select_changed_files(list_metadata_files('images_metadata/'), manifest)
+    if not fingerprints:
+        print("All documents are up to date")
+        if not os.path.exists(SPATIAL_INDEX_PATH):
+            write_spatial_index(pack=pack)
+        return
+
+    print(f"Indexing {len(fingerprints)} new or changed documents")
+
+    store = EmbeddingStore(os.getenv('EMBEDDING_STORE', 'embedding_store'))
+    stats = {'docs': 0, 'bytes': 0, 'failed': 0}
+    refresh_interval = _get_refresh_interval(es, index)
+    _set_refresh_interval(es, index, "-1")
+    start = time.perf_counter()
+    acknowledged = 0
+
+    try:
+        if pack is not None:
+            actions = generate_actions_from_pack(pack, set(fingerprints), index, stats)
+        elif workers > 1:
+            actions = generate_actions_multiprocess(metadata_files, index, stats, workers,
+                                                    threads_per_worker=threads_per_worker, store=store)
+        else:
+            actions = generate_actions(metadata_files, index, stats, store=store)
+        for ok, item in bulk_upload(es, actions, chunk_size=chunk_size, max_chunk_bytes=max_chunk_bytes,
+                                    parallel=parallel, thread_count=thread_count):
+            result = item.get("index", item)
+            if not ok:
+                stats['failed'] += 1
+                print(f"Failed to upload document {result.get('_id')}: {result.get('error')}")
+                continue
+
+            # Record acknowledged documents so an interrupted run resumes from here
+            manifest.update(result['_id'], fingerprints[result['_id']])
+            acknowledged += 1
+            if acknowledged % MANIFEST_SAVE_EVERY == 0:
+                manifest.save()
+    finally:
+        manifest.save()
+        _set_refresh_interval(es, index, refresh_interval)
+        es.indices.refresh(index=index)
 
-    es = Elasticsearch(hosts=host, api_key=api_key)
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    indexed = stats['docs'] - stats['failed']
+    print(f"Indexed {indexed}/{stats['docs']} documents in {elapsed:.1f}s "
+          f"({stats['docs'] / elapsed:.1f} docs/s, {stats['bytes'] / elapsed / 1024 / 1024:.2f} MB/s)")
 
-    metadata_files = list_metadata_files('images_metadata/')
+    write_spatial_index(pack=pack)
 
-    for doc in metadata_files:
-        data = add_embeddings(doc)
-        upload_document(es, data, index)
+    if force_merge_after and indexed:
+        force_merge(es, index)
 
 
-index_logic()
\ No newline at end of file
+if __name__ == "__main__":
+    index_logic()